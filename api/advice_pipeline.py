@@ -0,0 +1,314 @@
+import time
+import asyncio
+import logging
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+from api.models import AdviceResult, AssessmentData, QuestionEntry, ServiceOfferingAnswer
+from api.prompts import SYSTEM_PROMPT_TEMPLATE, USER_PROMPT_TEMPLATE
+from api.answer_catalog import catalog
+from api.scoring import engine as scoring_engine, question_id_for
+from api.llm_service import FALLBACK_PREFIX, build_messages, completion_key, iter_completed, track_usage
+from api.advice_store import advice_store, content_hash
+from api.assessment_state import AssessmentState, QuestionState, assessment_state_store
+from api.batch_prompting import BATCH_SIZE, iter_batched
+from api.observability import (ADVICE_REASSESSMENT_QUESTIONS, ADVICE_STORE_LOOKUPS, log_event, record_timing,
+                               span)
+
+PHASE_MAP = {
+    "Profitable": "Phase 1 (Profitable)",
+    "Repeatable": "Phase 2 (Repeatable)",
+    "Scalable": "Phase 3 (Scalable)"
+}
+PHASE_ORDER = ["Profitable", "Repeatable", "Scalable"]
+
+PROFILE_FIELDS = ("industry", "business_challenge", "service_type", "revenue_type")
+MISSING_ANSWER_TEXT = "未找到数据库答案。"
+
+
+@dataclass
+class ScoredQuestion:
+    """编号并完成加权的问题。"""
+    question_id: str
+    entry: QuestionEntry
+    new_score: float
+    new_category: str
+
+
+@dataclass
+class PreparedAssessment:
+    """完成加权、检索和 prompt 构建、等待调用 LLM 的评估。"""
+    questions: List[ScoredQuestion]
+    profile: Dict[str, str]
+    base_texts: List[str]
+    system_prompt: str
+    message_batches: List[List[Dict[str, str]]]
+    prompt_keys: List[str]  # 每题的 completion_key，用于查询预生成建议库和判断重新提交时是否变化
+
+
+@dataclass
+class GeneratedAdvice:
+    results: List[AdviceResult]
+    advice_text: str
+    reused: int = 0  # 直接复用该用户上次提交建议的问题数
+
+
+def extract_profile(service_offering: Dict[str, ServiceOfferingAnswer]) -> Dict[str, str]:
+    # Extract business profile fields from service offering
+    profile = {}
+    for field in PROFILE_FIELDS:
+        answer = service_offering.get(field)
+        profile[field] = (answer.text if answer is not None else None) or ''
+    return profile
+
+
+def score_questions(assessment_data: AssessmentData) -> List[ScoredQuestion]:
+    """收集所有问题并按顺序编号，计算加权后的 new_score / new_category。"""
+    # 1. 收集所有问题，按顺序编号
+    entries = assessment_data.questions()
+    # 2. 处理加权和新分类（规则已在启动时编译，所有问题一次性计算）
+    scored = scoring_engine.score_questions(assessment_data.serviceOffering, entries)
+    return [
+        ScoredQuestion(question_id_for(idx), entry, new_score, new_category)
+        for idx, (entry, (new_score, new_category)) in enumerate(zip(entries, scored))
+    ]
+
+
+async def retrieve_texts(all_questions: List[ScoredQuestion]) -> List[str]:
+    """从答案目录批量检索每个问题的基础回答文本。"""
+    pairs = [(q.question_id, q.new_category) for q in all_questions]
+    if catalog.loaded:
+        base_texts = catalog.get_answer_texts(pairs)
+    else:
+        # 目录尚未加载时会逐条查询数据库，放到线程中执行以免阻塞事件循环
+        base_texts = await asyncio.to_thread(catalog.get_answer_texts, pairs)
+    return [MISSING_ANSWER_TEXT if text is None else text for text in base_texts]
+
+
+def build_message_batches(all_questions: List[ScoredQuestion], base_texts: List[str],
+                          system_prompt: str) -> List[List[Dict[str, str]]]:
+    message_batches = []
+    for q, base_text in zip(all_questions, base_texts):
+        # 构建prompt with new business profile fields
+        prompt = USER_PROMPT_TEMPLATE.format(
+            retrieved_text=base_text,
+            original_question=q.entry.question,
+            advice_type=q.new_category
+        )
+        message_batches.append(build_messages(system_prompt, prompt))
+    return message_batches
+
+
+async def prepare_assessment(assessment_data: AssessmentData) -> PreparedAssessment:
+    with span("scoring"):
+        all_questions = score_questions(assessment_data)
+        profile = extract_profile(assessment_data.serviceOffering)
+    # 3. 检索数据库并增强
+    with span("retrieval"):
+        base_texts = await retrieve_texts(all_questions)
+    with span("prompt"):
+        system_prompt = SYSTEM_PROMPT_TEMPLATE.format(**profile)
+        message_batches = build_message_batches(all_questions, base_texts, system_prompt)
+        prompt_keys = [completion_key(messages) for messages in message_batches]
+    return PreparedAssessment(all_questions, profile, base_texts, system_prompt, message_batches, prompt_keys)
+
+
+def make_result(q: ScoredQuestion, advice: str) -> AdviceResult:
+    return AdviceResult(catmapping=q.entry.catmapping, category=q.entry.category,
+                        question=q.entry.question, advice=advice)
+
+
+def group_by_phase(results: List[AdviceResult]) -> Dict[str, Dict[str, List[AdviceResult]]]:
+    # 4. 分阶段、分category分组：phase -> category -> [advice]
+    phase_grouped = {phase: defaultdict(list) for phase in PHASE_ORDER}
+    for item in results:
+        if item.catmapping in phase_grouped:
+            phase_grouped[item.catmapping][item.category].append(item)
+    return phase_grouped
+
+
+def assemble_advice_text(results: List[AdviceResult]) -> str:
+    with span("assembly"):
+        return _assemble_advice_text(results)
+
+
+def _assemble_advice_text(results: List[AdviceResult]) -> str:
+    phase_grouped = group_by_phase(results)
+    # 5. 拼接建议文本
+    advice_text = "Based on your assessment results, here are your business recommendations:\n\n"
+    for phase in PHASE_ORDER:
+        phase_title = PHASE_MAP[phase]
+        advice_text += f"=== {phase_title} ===\n"
+        for category, items in phase_grouped[phase].items():
+            advice_text += f"\n【{category}】\n"
+            for item in items:
+                advice_text += f"- {item.question}\n  {item.advice}\n"
+        advice_text += "\n"
+    return advice_text
+
+
+def phase_outline(results: List[AdviceResult]) -> List[Dict[str, Any]]:
+    """与 assemble_advice_text 相同的阶段/分类顺序，以结构化形式返回（每项为结果下标）。"""
+    index_of = {id(item): idx for idx, item in enumerate(results)}
+    outline = []
+    for phase, categories in group_by_phase(results).items():
+        outline.append({
+            "phase": phase,
+            "title": PHASE_MAP[phase],
+            "categories": [
+                {"category": category, "items": [index_of[id(item)] for item in items]}
+                for category, items in categories.items()
+            ]
+        })
+    return outline
+
+
+def diff_assessment(prepared: PreparedAssessment, state: AssessmentState) -> Tuple[Dict[int, str], Counter]:
+    """
+    对比本次提交和该用户上次的状态，返回 (可复用的建议 {问题下标: 建议}, 各原因的题数)。
+
+    画像、new_category、检索文本或 prompt（问题原文、模板、模型参数）任一变化的问题需要重新生成，
+    上次生成失败（兜底文本）的问题也会重新生成。
+    """
+    known: Dict[int, str] = {}
+    outcomes: Counter = Counter()
+    profile_changed = state.profile != prepared.profile
+    for idx, (q, base_text, key) in enumerate(zip(prepared.questions, prepared.base_texts, prepared.prompt_keys)):
+        previous = state.questions.get(q.question_id)
+        if previous is None:
+            outcome = "new_question"
+        elif profile_changed:
+            outcome = "profile_changed"
+        elif previous.new_category != q.new_category:
+            outcome = "category_changed"
+        elif previous.source_hash != content_hash(base_text):
+            outcome = "text_changed"
+        elif previous.prompt_key != key:
+            outcome = "prompt_changed"
+        elif previous.advice.startswith(FALLBACK_PREFIX):
+            outcome = "previous_failed"
+        else:
+            known[idx] = previous.advice
+            outcome = "reused"
+        outcomes[outcome] += 1
+    return known, outcomes
+
+
+async def load_known_advice(user_id: str, prepared: PreparedAssessment) -> Dict[int, str]:
+    """读取该用户上次的评估状态，返回本次可直接复用的建议；没有状态时返回空字典。"""
+    if assessment_state_store is None or not user_id:
+        return {}
+    try:
+        state = await assessment_state_store.get(user_id)
+    except Exception as e:
+        logging.error(f"读取评估状态失败: {e}")
+        return {}
+    if state is None:
+        return {}
+    known, outcomes = diff_assessment(prepared, state)
+    for outcome, count in outcomes.items():
+        ADVICE_REASSESSMENT_QUESTIONS.labels(outcome).inc(count)
+    log_event("assessment_resubmitted", userId=user_id, questions=len(prepared.questions),
+              reused=len(known), **{k: v for k, v in outcomes.items() if k != "reused"})
+    return known
+
+
+async def save_assessment_state(user_id: str, prepared: PreparedAssessment, results: Sequence[AdviceResult]) -> None:
+    """保存本次的加权结果、画像和逐题建议，供该用户下次提交时对比。"""
+    if assessment_state_store is None or not user_id:
+        return
+    questions = {
+        q.question_id: QuestionState(q.entry.question, q.new_score, q.new_category, content_hash(base_text),
+                                     key, item.advice)
+        for q, base_text, key, item in zip(prepared.questions, prepared.base_texts, prepared.prompt_keys, results)
+    }
+    try:
+        await assessment_state_store.save(AssessmentState(user_id, prepared.profile, questions))
+    except Exception as e:
+        logging.error(f"保存评估状态失败: {e}")
+
+
+async def lookup_precomputed(prepared: PreparedAssessment, indices: Sequence[int]) -> Dict[int, str]:
+    """在预生成建议库中查询指定问题的完整 prompt，返回 {问题下标: 建议}。"""
+    if advice_store is None or not indices:
+        return {}
+    with span("advice_store"):
+        keys = [prepared.prompt_keys[idx] for idx in indices]
+        try:
+            found = await asyncio.to_thread(advice_store.get_many, keys)
+        except Exception as e:
+            logging.error(f"读取预生成建议库失败: {e}")
+            return {}
+    hits = {idx: found[key] for idx, key in zip(indices, keys) if key in found}
+    ADVICE_STORE_LOOKUPS.labels("hit").inc(len(hits))
+    ADVICE_STORE_LOOKUPS.labels("miss").inc(len(keys) - len(hits))
+    return hits
+
+
+async def iter_advice(prepared: PreparedAssessment, batch_size: int = BATCH_SIZE,
+                      known: Optional[Dict[int, str]] = None) -> AsyncIterator[Tuple[int, AdviceResult]]:
+    """
+    按完成顺序逐题产出 (问题下标, 结果)。
+
+    known 中的问题（见 load_known_advice）和预生成建议库中已有的问题立即产出，其余问题才调用LLM。
+    batch_size > 1 时使用批量模式，同一阶段的问题打包到一次调用中。
+    结束时记录本次请求的LLM调用次数和 token 用量，用于对比批量和逐题模式。
+    """
+    usage = track_usage()
+    known = known or {}
+    for idx, advice in known.items():
+        yield idx, make_result(prepared.questions[idx], advice)
+    pending = [idx for idx in range(len(prepared.questions)) if idx not in known]
+    precomputed = await lookup_precomputed(prepared, pending)
+    for idx, advice in precomputed.items():
+        yield idx, make_result(prepared.questions[idx], advice)
+    # 只对未命中的问题调用LLM，下标映射回原问题
+    pending = [idx for idx in pending if idx not in precomputed]
+    if not pending:
+        log_event("advice_precomputed", questions=len(prepared.questions), reused=len(known),
+                  precomputed=len(precomputed))
+        return
+
+    start = time.perf_counter()
+    messages = [prepared.message_batches[idx] for idx in pending]
+    if batch_size > 1:
+        completed = iter_batched(prepared.system_prompt, [prepared.questions[idx] for idx in pending],
+                                 [prepared.base_texts[idx] for idx in pending], messages, batch_size)
+    else:
+        completed = iter_completed(messages)
+    try:
+        async for pos, advice in completed:
+            idx = pending[pos]
+            yield idx, make_result(prepared.questions[idx], advice)
+    finally:
+        # 提前关闭时取消剩余的LLM调用
+        await completed.aclose()
+        record_timing("llm", time.perf_counter() - start)
+        log_event(
+            "llm_token_usage",
+            mode="batched" if batch_size > 1 else "single",
+            batch_size=batch_size,
+            questions=len(prepared.questions),
+            reused=len(known),
+            precomputed=len(precomputed),
+            calls=usage.calls,
+            prompt_tokens=usage.prompt_tokens,
+            completion_tokens=usage.completion_tokens,
+            total_tokens=usage.total_tokens
+        )
+
+
+async def generate_advice(assessment_data: AssessmentData, user_id: str = "") -> GeneratedAdvice:
+    """
+    完整执行 加权 → 检索 → LLM → 拼接。
+
+    传入 user_id 时与该用户上次提交的状态对比，只对发生变化的问题调用LLM，完成后保存本次状态。
+    """
+    prepared = await prepare_assessment(assessment_data)
+    known = await load_known_advice(user_id, prepared)
+    # 并发调用LLM，结果按问题顺序放回
+    results = [None] * len(prepared.questions)
+    async for idx, item in iter_advice(prepared, known=known):
+        results[idx] = item
+    await save_assessment_state(user_id, prepared, results)
+    return GeneratedAdvice(results, assemble_advice_text(results), len(known))
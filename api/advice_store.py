@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import zlib
+import hashlib
+import sqlite3
+import threading
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+from dotenv import load_dotenv
+from api.prompts import SYSTEM_PROMPT_TEMPLATE, USER_PROMPT_TEMPLATE
+from api.llm_service import DEPLOYMENT, MAX_TOKENS, TEMPERATURE
+
+# --- 配置 ---
+load_dotenv()
+ADVICE_STORE_ENABLED = os.getenv("ADVICE_STORE_ENABLED", "1") not in ("0", "false", "False")
+# 预生成建议库文件（SQLite），由 python -m api.pregenerate_advice 写入，服务只读查询
+ADVICE_STORE_PATH = os.getenv("ADVICE_STORE_PATH", "data/advice_store.sqlite3")
+
+# SQLite 单条语句的参数个数上限（旧版本为 999）
+_MAX_SQL_VARIABLES = 900
+
+
+def content_hash(*parts: str) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def current_template_hash() -> str:
+    """prompt 模板和模型参数的哈希，任一变化后之前生成的建议全部失效。"""
+    params = json.dumps({"model": DEPLOYMENT, "temperature": TEMPERATURE, "max_tokens": MAX_TOKENS}, sort_keys=True)
+    return content_hash(SYSTEM_PROMPT_TEMPLATE, USER_PROMPT_TEMPLATE, params)
+
+
+@dataclass
+class StoredAdvice:
+    key: str            # completion_key(完整消息)，与补全缓存的键相同
+    question_id: str
+    category: str
+    profile_hash: str
+    template_hash: str
+    source_hash: str    # 答案目录检索文本的哈希
+    advice: str
+
+
+class AdviceStore:
+    """
+    预生成建议库：按完整 prompt 的内容哈希索引，建议文本 zlib 压缩存储。
+
+    prompt 模板或答案目录文本变化后 prompt 不同，旧记录不会再被命中；prune 用于清理这些记录。
+    库文件不存在时查询直接返回空结果，离线任务生成后无需重启服务即可生效。
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self, create: bool = False) -> Optional[sqlite3.Connection]:
+        if self._conn is None:
+            if not create and not os.path.exists(self._path):
+                return None
+            directory = os.path.dirname(self._path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self._path, timeout=30, check_same_thread=False)
+            # WAL 模式下离线任务写入时服务仍可读取
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS advice (key TEXT PRIMARY KEY, question_id TEXT NOT NULL, "
+                "category TEXT NOT NULL, profile_hash TEXT NOT NULL, template_hash TEXT NOT NULL, "
+                "source_hash TEXT NOT NULL, advice BLOB NOT NULL, created_at REAL NOT NULL) WITHOUT ROWID"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_advice_source ON advice (question_id, category, source_hash)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_advice_template ON advice (template_hash)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _select_keys(self, conn: sqlite3.Connection, columns: str, keys: Sequence[str]) -> List[tuple]:
+        rows = []
+        for start in range(0, len(keys), _MAX_SQL_VARIABLES):
+            chunk = keys[start:start + _MAX_SQL_VARIABLES]
+            rows.extend(conn.execute(
+                f"SELECT {columns} FROM advice WHERE key IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall())
+        return rows
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, str]:
+        """批量查询，返回 {key: 建议文本}，未命中的键不在结果中。"""
+        if not keys:
+            return {}
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return {}
+            rows = self._select_keys(conn, "key, advice", keys)
+        return {key: zlib.decompress(advice).decode("utf-8") for key, advice in rows}
+
+    def existing_keys(self, keys: Sequence[str]) -> Set[str]:
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return set()
+            return {key for (key,) in self._select_keys(conn, "key", keys)}
+
+    def put_many(self, records: Iterable[StoredAdvice]) -> None:
+        now = time.time()
+        with self._lock:
+            conn = self._connect(create=True)
+            conn.executemany(
+                "INSERT OR REPLACE INTO advice (key, question_id, category, profile_hash, template_hash, "
+                "source_hash, advice, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(r.key, r.question_id, r.category, r.profile_hash, r.template_hash, r.source_hash,
+                  zlib.compress(r.advice.encode("utf-8")), now) for r in records]
+            )
+            conn.commit()
+
+    def source_pairs(self) -> List[Tuple[str, str]]:
+        """库中出现过的所有 (question_id, category)。"""
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return []
+            return [tuple(row) for row in conn.execute("SELECT DISTINCT question_id, category FROM advice")]
+
+    def prune(self, template_hash: str, source_hashes: Dict[Tuple[str, str], str]) -> int:
+        """
+        删除失效记录：prompt 模板/模型参数已变化，或 (question_id, category) 的检索文本已变化。
+
+        Args:
+            template_hash (str): current_template_hash()。
+            source_hashes: 当前答案目录中每个 (question_id, category) 检索文本的哈希，见 source_pairs。
+
+        Returns:
+            int: 删除的记录数。
+        """
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return 0
+            removed = conn.execute("DELETE FROM advice WHERE template_hash != ?", (template_hash,)).rowcount
+            stale = [
+                (question_id, category, source_hash)
+                for question_id, category, source_hash in conn.execute(
+                    "SELECT DISTINCT question_id, category, source_hash FROM advice"
+                )
+                if source_hashes.get((question_id, category)) != source_hash
+            ]
+            for row in stale:
+                removed += conn.execute(
+                    "DELETE FROM advice WHERE question_id = ? AND category = ? AND source_hash = ?", row
+                ).rowcount
+            conn.commit()
+            if removed:
+                conn.execute("VACUUM")
+            return removed
+
+    def count(self) -> int:
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return 0
+            (count,) = conn.execute("SELECT COUNT(*) FROM advice").fetchone()
+            return count
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def create_advice_store() -> Optional[AdviceStore]:
+    """根据环境变量创建建议库；ADVICE_STORE_ENABLED=0 时返回 None。"""
+    if not ADVICE_STORE_ENABLED or not ADVICE_STORE_PATH:
+        return None
+    return AdviceStore(ADVICE_STORE_PATH)
+
+
+# --- 全局建议库实例 ---
+advice_store = create_advice_store()
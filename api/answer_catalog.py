@@ -0,0 +1,143 @@
+import os
+import csv
+import json
+import logging
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from dotenv import load_dotenv
+
+# --- 配置 ---
+load_dotenv()
+# 设置后从本地 JSON/CSV 文件加载答案目录（测试或离线环境），否则从 Cosmos DB 加载
+CATALOG_PATH = os.getenv("ANSWER_CATALOG_PATH")
+# 后台刷新间隔（秒），<= 0 表示只在启动时加载一次
+CATALOG_TTL = float(os.getenv("ANSWER_CATALOG_TTL", "300"))
+
+AnswerKey = Tuple[str, str]
+
+
+def load_answers_from_file(path: str) -> List[Dict[str, str]]:
+    """
+    从本地 JSON 或 CSV 文件读取回答记录。
+
+    JSON 文件为记录数组；CSV 文件需包含 question_id、category、text 三列。
+
+    Args:
+        path (str): 文件路径，按扩展名区分格式。
+
+    Returns:
+        List[Dict[str, str]]: 回答记录列表。
+    """
+    if path.lower().endswith(".csv"):
+        with open(path, newline='', encoding='utf-8-sig') as csvfile:
+            return list(csv.DictReader(csvfile))
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def build_index(items: Iterable[Dict[str, str]]) -> Dict[AnswerKey, str]:
+    """将回答记录构建为 {(question_id, category): text} 索引，重复键保留第一条。"""
+    index = {}
+    for item in items:
+        key = (item.get("question_id"), item.get("category"))
+        if key in index:
+            logging.warning(f"答案目录中存在重复项: question_id='{key[0]}', category='{key[1]}'，保留第一条。")
+            continue
+        index[key] = item.get("text")
+    return index
+
+
+class AnswerCatalog:
+    """
+    常驻内存的答案目录。
+
+    启动时一次性加载全部回答，之后按 TTL 在后台线程中重新加载，
+    新快照构建完成后整体替换旧快照，读取方不会看到加载到一半的数据。
+    """
+
+    def __init__(self, loader: Callable[[], Iterable[Dict[str, str]]], ttl: float = CATALOG_TTL,
+                 fallback: Optional[Callable[[str, str], Optional[str]]] = None):
+        """
+        Args:
+            loader: 返回全部回答记录的函数。
+            ttl (float): 后台刷新间隔（秒），<= 0 表示不刷新。
+            fallback: 目录从未加载成功时使用的单条查询函数。
+        """
+        self._loader = loader
+        self._ttl = ttl
+        self._fallback = fallback
+        self._snapshot: Optional[Dict[AnswerKey, str]] = None
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._snapshot is not None
+
+    def __len__(self) -> int:
+        return len(self._snapshot or {})
+
+    def refresh(self) -> bool:
+        """重新加载目录。失败时保留旧快照并返回 False。"""
+        try:
+            snapshot = build_index(self._loader())
+        except Exception as e:
+            logging.error(f"加载答案目录失败: {e}")
+            return False
+        # 单次引用赋值即完成替换，读取方拿到的要么是旧快照，要么是新快照
+        self._snapshot = snapshot
+        logging.info(f"答案目录已加载，共 {len(snapshot)} 条")
+        return True
+
+    def get_answer_text(self, question_id: str, category: str) -> Optional[str]:
+        return self.get_answer_texts([(question_id, category)])[0]
+
+    def get_answer_texts(self, pairs: Sequence[AnswerKey]) -> List[Optional[str]]:
+        """
+        批量获取回答文本，顺序与 pairs 一致。
+
+        Args:
+            pairs (Sequence[Tuple[str, str]]): (question_id, category) 列表。
+
+        Returns:
+            List[Optional[str]]: 找到则为回答文本，否则为 None。
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            if self._fallback is None:
+                logging.error("答案目录尚未加载，无法检索。")
+                return [None] * len(pairs)
+            return [self._fallback(qid, category) for qid, category in pairs]
+        return [snapshot.get(pair) for pair in pairs]
+
+    def start(self) -> None:
+        """首次加载并启动后台刷新线程。"""
+        self.refresh()
+        if self._ttl <= 0 or self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._refresh_loop, name="answer-catalog-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _refresh_loop(self) -> None:
+        while not self._stop_event.wait(self._ttl):
+            self.refresh()
+
+
+def create_catalog() -> AnswerCatalog:
+    """根据环境变量创建答案目录：配置了 ANSWER_CATALOG_PATH 时使用本地文件，否则使用 Cosmos DB。"""
+    if CATALOG_PATH:
+        return AnswerCatalog(lambda: load_answers_from_file(CATALOG_PATH))
+    from api.cosmos_retriever import load_all_answers, get_answer_text
+    return AnswerCatalog(load_all_answers, fallback=get_answer_text)
+
+
+# --- 全局目录实例 ---
+# 在应用启动（lifespan）时调用 catalog.start() 加载，关闭时调用 catalog.stop()。
+catalog = create_catalog()
@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field, asdict
+from typing import Dict, Optional
+from dotenv import load_dotenv
+
+# --- 配置 ---
+load_dotenv()
+# 每个用户上一次评估的状态存储：memory（单进程）/ sqlite（多个 uvicorn worker 共享）/ none（不做增量生成）
+ASSESSMENT_STATE_BACKEND = os.getenv("ASSESSMENT_STATE_BACKEND", "memory")
+ASSESSMENT_STATE_PATH = os.getenv("ASSESSMENT_STATE_PATH", "data/assessment_state.sqlite3")
+# 状态保留时间（秒），超过后重新提交按首次提交处理
+ASSESSMENT_STATE_TTL = float(os.getenv("ASSESSMENT_STATE_TTL", str(30 * 24 * 3600)))
+# memory 后端最多保留的用户数，超出后淘汰最久未提交的用户
+ASSESSMENT_STATE_MAX_USERS = int(os.getenv("ASSESSMENT_STATE_MAX_USERS", "1000"))
+
+
+@dataclass
+class QuestionState:
+    """上一次提交中一道题的加权结果和生成的建议。"""
+    question: str
+    new_score: float
+    new_category: str
+    source_hash: str    # 检索到的答案文本的哈希
+    prompt_key: str     # completion_key(完整消息)，模板、模型参数或问题原文变化时随之变化
+    advice: str
+
+
+@dataclass
+class AssessmentState:
+    user_id: str
+    profile: Dict[str, str]
+    questions: Dict[str, QuestionState]   # question_id -> QuestionState
+    updated_at: float = field(default_factory=time.time)
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self), ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, data: str) -> "AssessmentState":
+        raw = json.loads(data)
+        raw["questions"] = {qid: QuestionState(**q) for qid, q in raw["questions"].items()}
+        return cls(**raw)
+
+
+class InMemoryAssessmentStateStore:
+    """进程内状态存储，仅适用于单个 worker。"""
+
+    def __init__(self, max_users: int = ASSESSMENT_STATE_MAX_USERS, ttl: float = ASSESSMENT_STATE_TTL):
+        self._states: "OrderedDict[str, AssessmentState]" = OrderedDict()
+        self._max_users = max_users
+        self._ttl = ttl
+
+    async def get(self, user_id: str) -> Optional[AssessmentState]:
+        state = self._states.get(user_id)
+        if state is not None and self._ttl > 0 and time.time() - state.updated_at > self._ttl:
+            del self._states[user_id]
+            return None
+        return state
+
+    async def save(self, state: AssessmentState) -> None:
+        state.updated_at = time.time()
+        self._states[state.user_id] = state
+        self._states.move_to_end(state.user_id)
+        while len(self._states) > self._max_users:
+            self._states.popitem(last=False)
+
+
+class SQLiteAssessmentStateStore:
+    """基于 SQLite 的状态存储，多个 uvicorn worker 进程共享同一文件。"""
+
+    def __init__(self, path: str, ttl: float = ASSESSMENT_STATE_TTL):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._writes_since_expire = 0
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS assessment_state (user_id TEXT PRIMARY KEY, updated_at REAL NOT NULL, "
+            "data TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_assessment_state_updated ON assessment_state (updated_at)")
+        self._conn.commit()
+
+    def _get(self, user_id: str) -> Optional[AssessmentState]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data, updated_at FROM assessment_state WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        if row is None or (self._ttl > 0 and time.time() - row[1] > self._ttl):
+            return None
+        return AssessmentState.from_json(row[0])
+
+    def _save(self, state: AssessmentState) -> None:
+        state.updated_at = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO assessment_state (user_id, updated_at, data) VALUES (?, ?, ?)",
+                (state.user_id, state.updated_at, state.to_json())
+            )
+            self._writes_since_expire += 1
+            # 每写入一批再清理过期状态
+            if self._ttl > 0 and self._writes_since_expire >= 100:
+                self._writes_since_expire = 0
+                self._conn.execute("DELETE FROM assessment_state WHERE updated_at < ?", (time.time() - self._ttl,))
+            self._conn.commit()
+
+    async def get(self, user_id: str) -> Optional[AssessmentState]:
+        return await asyncio.to_thread(self._get, user_id)
+
+    async def save(self, state: AssessmentState) -> None:
+        await asyncio.to_thread(self._save, state)
+
+
+def create_state_store():
+    if ASSESSMENT_STATE_BACKEND == "sqlite":
+        return SQLiteAssessmentStateStore(ASSESSMENT_STATE_PATH)
+    if ASSESSMENT_STATE_BACKEND == "memory":
+        return InMemoryAssessmentStateStore()
+    if ASSESSMENT_STATE_BACKEND == "none":
+        return None
+    raise ValueError(f"未知的 ASSESSMENT_STATE_BACKEND: {ASSESSMENT_STATE_BACKEND}")
+
+
+# --- 全局状态存储 ---
+assessment_state_store = create_state_store()
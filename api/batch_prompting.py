@@ -0,0 +1,138 @@
+import os
+import json
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import TYPE_CHECKING, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+from dotenv import load_dotenv
+from api.prompts import BATCH_USER_PROMPT_TEMPLATE
+from api.llm_service import (MAX_TOKENS, build_messages, cached_complete, complete_or_fallback,
+                             new_request_limiter)
+from api.observability import LLM_RETRIES
+
+if TYPE_CHECKING:
+    from api.advice_pipeline import ScoredQuestion
+
+# --- 配置 ---
+load_dotenv()
+# 每次LLM调用打包的问题数，<= 1 表示逐题调用（默认）
+BATCH_SIZE = int(os.getenv("LLM_BATCH_SIZE", "1"))
+# 批量调用的 max_tokens 上限（按 问题数 × 单题 max_tokens 计算，不超过该值）
+BATCH_MAX_TOKENS = int(os.getenv("LLM_BATCH_MAX_TOKENS", "4096"))
+# 批量调用的超时时间（秒），一次要生成多段建议，默认比单题更长
+BATCH_CALL_TIMEOUT = float(os.getenv("LLM_BATCH_CALL_TIMEOUT", "120"))
+
+
+def plan_batches(questions: Sequence["ScoredQuestion"], batch_size: int) -> List[List[int]]:
+    """按阶段（catmapping）分组后切分为不超过 batch_size 的批次，返回问题下标列表。"""
+    by_phase: "OrderedDict[str, List[int]]" = OrderedDict()
+    for idx, q in enumerate(questions):
+        by_phase.setdefault(q.entry.catmapping, []).append(idx)
+    batches = []
+    for indices in by_phase.values():
+        for start in range(0, len(indices), batch_size):
+            batches.append(indices[start:start + batch_size])
+    return batches
+
+
+def build_batch_messages(system_prompt: str, questions: Sequence["ScoredQuestion"],
+                         base_texts: Sequence[str], indices: Sequence[int]) -> List[Dict[str, str]]:
+    items = [
+        {
+            "question_id": questions[i].question_id,
+            "original_question": questions[i].entry.question,
+            "advice_type": questions[i].new_category,
+            "retrieved_text": base_texts[i]
+        }
+        for i in indices
+    ]
+    prompt = BATCH_USER_PROMPT_TEMPLATE.format(questions_json=json.dumps(items, ensure_ascii=False, indent=2))
+    return build_messages(system_prompt, prompt)
+
+
+def parse_batch_response(content: str, expected_ids: Sequence[str]) -> Dict[str, str]:
+    """
+    解析批量调用返回的 JSON，返回 {question_id: advice}。
+
+    只保留属于本批次、advice 为非空字符串的条目；同一 question_id 出现多次时保留第一条。
+
+    Raises:
+        ValueError: 返回内容不是预期结构，或没有任何有效条目。
+    """
+    data = json.loads(content)
+    recommendations = data.get("recommendations") if isinstance(data, dict) else data
+    if not isinstance(recommendations, list):
+        raise ValueError("批量响应缺少 recommendations 数组")
+    expected = set(expected_ids)
+    parsed = {}
+    for item in recommendations:
+        if not isinstance(item, dict):
+            continue
+        qid, advice = item.get("question_id"), item.get("advice")
+        if qid in expected and qid not in parsed and isinstance(advice, str) and advice.strip():
+            parsed[qid] = advice.strip()
+    if not parsed:
+        raise ValueError("批量响应中没有有效的建议")
+    return parsed
+
+
+async def _run_batch(system_prompt: str, questions: Sequence["ScoredQuestion"], base_texts: Sequence[str],
+                     single_messages: Sequence[List[Dict[str, str]]], indices: List[int],
+                     request_semaphore: asyncio.Semaphore) -> List[Tuple[int, str]]:
+    if len(indices) == 1:
+        idx = indices[0]
+        return [(idx, await complete_or_fallback(single_messages[idx], request_semaphore))]
+
+    ids = [questions[i].question_id for i in indices]
+    parsed = {}
+    try:
+        content = await cached_complete(
+            build_batch_messages(system_prompt, questions, base_texts, indices),
+            request_semaphore,
+            validate=lambda c: parse_batch_response(c, ids),
+            timeout=BATCH_CALL_TIMEOUT,
+            max_tokens=min(MAX_TOKENS * len(indices), BATCH_MAX_TOKENS),
+            response_format={"type": "json_object"}
+        )
+        parsed = parse_batch_response(content, ids)
+    except Exception as e:
+        logging.warning(f"批量LLM调用失败，改为逐题调用: {e}")
+        LLM_RETRIES.labels("batch_failed").inc(len(indices))
+
+    # 缺失或格式错误的问题单独重试
+    missing = [i for i in indices if questions[i].question_id not in parsed]
+    if missing and parsed:
+        logging.warning(f"批量响应缺少 {len(missing)}/{len(indices)} 个问题，逐题重试")
+        LLM_RETRIES.labels("batch_missing").inc(len(missing))
+    retried = await asyncio.gather(*[complete_or_fallback(single_messages[i], request_semaphore) for i in missing])
+    retried_by_idx = dict(zip(missing, retried))
+    return [(i, parsed.get(questions[i].question_id) or retried_by_idx[i]) for i in indices]
+
+
+async def iter_batched(system_prompt: str, questions: Sequence["ScoredQuestion"], base_texts: Sequence[str],
+                       single_messages: Sequence[List[Dict[str, str]]], batch_size: int = BATCH_SIZE,
+                       max_concurrency: Optional[int] = None) -> AsyncIterator[Tuple[int, str]]:
+    """
+    以批量模式生成建议，每个批次完成后产出其中各题的 (问题下标, 建议文本)。
+
+    Args:
+        system_prompt (str): 已渲染的 system prompt，每个批次只发送一次。
+        questions: 已编号并完成加权的问题。
+        base_texts: 与 questions 对应的检索文本。
+        single_messages: 与 questions 对应的逐题消息，用于单独重试。
+        batch_size (int): 每批最多的问题数。
+        max_concurrency (Optional[int]): 本次请求的并发上限。
+    """
+    request_semaphore = new_request_limiter(max_concurrency)
+    tasks = [
+        asyncio.ensure_future(_run_batch(system_prompt, questions, base_texts, single_messages, indices,
+                                         request_semaphore))
+        for indices in plan_batches(questions, batch_size)
+    ]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            for item in await next_done:
+                yield item
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,239 @@
+import os
+import time
+import json
+import asyncio
+import hashlib
+import functools
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+from dotenv import load_dotenv
+from api.observability import LLM_CACHE_EVENTS
+
+# --- 配置 ---
+load_dotenv()
+CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") not in ("0", "false", "False")
+# 磁盘缓存文件（SQLite），多个 uvicorn worker 可共享；设为空字符串则只使用内存缓存
+CACHE_PATH = os.getenv("LLM_CACHE_PATH", ".cache/llm_completions.sqlite3")
+# 缓存有效期（秒），<= 0 表示永不过期
+CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+# 内存 LRU 最多保留的条目数
+CACHE_MEMORY_SIZE = int(os.getenv("LLM_CACHE_MEMORY_SIZE", "2048"))
+# 磁盘缓存最多保留的条目数，超出后按最近访问时间淘汰
+CACHE_MAX_ROWS = int(os.getenv("LLM_CACHE_MAX_ROWS", "100000"))
+
+
+def make_key(messages: Any, **params: Any) -> str:
+    """对完整渲染后的消息和模型参数做哈希，作为缓存键。"""
+    payload = json.dumps({"messages": messages, "params": params}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SQLiteCompletionStore:
+    """磁盘缓存层。所有方法都是同步的，由 CompletionCache 放到线程中调用。"""
+
+    def __init__(self, path: str, ttl: float = CACHE_TTL, max_rows: int = CACHE_MAX_ROWS):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._ttl = ttl
+        self._max_rows = max_rows
+        self._lock = threading.Lock()
+        self._writes_since_evict = 0
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        # WAL 模式允许多个 worker 进程同时读写
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_completions_accessed ON completions (accessed_at)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created_at FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if self._ttl > 0 and now - created_at > self._ttl:
+                self._conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE completions SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now)
+            )
+            self._writes_since_evict += 1
+            # 每写入一批再检查容量，避免每次写入都做 COUNT
+            if self._max_rows > 0 and self._writes_since_evict >= 100:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        self._writes_since_evict = 0
+        if self._ttl > 0:
+            self._conn.execute("DELETE FROM completions WHERE created_at < ?", (time.time() - self._ttl,))
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM completions").fetchone()
+        if count > self._max_rows:
+            self._conn.execute(
+                "DELETE FROM completions WHERE key IN "
+                "(SELECT key FROM completions ORDER BY accessed_at ASC LIMIT ?)",
+                (count - self._max_rows,)
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class _Flight:
+    """一个正在进行的补全调用，以及当前等待它的请求数。"""
+
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: "asyncio.Task[str]"):
+        self.task = task
+        self.waiters = 0
+
+
+class CompletionCache:
+    """
+    LLM 补全结果缓存：进程内 LRU + 可选的 SQLite 磁盘层。
+
+    相同键的并发请求只会触发一次 LLM 调用（single-flight），其余请求等待同一结果。
+    调用在独立的任务中运行，某个等待者被取消不会影响其它等待者；所有等待者都取消后才取消调用。
+    只缓存成功的结果，调用失败时异常会传给所有等待者。
+    """
+
+    def __init__(self, store: Optional[SQLiteCompletionStore] = None,
+                 memory_size: int = CACHE_MEMORY_SIZE, ttl: float = CACHE_TTL):
+        self._store = store
+        self._memory_size = memory_size
+        self._ttl = ttl
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._inflight: Dict[str, _Flight] = {}
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0}
+
+    def _memory_get(self, key: str) -> Optional[str]:
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and time.time() > expires_at:
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return value
+
+    def _memory_set(self, key: str, value: str) -> None:
+        expires_at = time.time() + self._ttl if self._ttl > 0 else None
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self._memory_size:
+            self._memory.popitem(last=False)
+
+    async def get_or_create(self, key: str, factory: Callable[[], Awaitable[str]]) -> str:
+        """
+        命中缓存时直接返回，否则调用 factory 生成并写入缓存。
+
+        Args:
+            key (str): make_key 生成的缓存键。
+            factory: 未命中时调用的协程函数。
+
+        Returns:
+            str: 缓存或新生成的补全文本。
+        """
+        value = self._memory_get(key)
+        if value is not None:
+            self.stats["memory_hits"] += 1
+            LLM_CACHE_EVENTS.labels("memory_hit").inc()
+            return value
+
+        while True:
+            flight = self._inflight.get(key)
+            if flight is None:
+                flight = _Flight(asyncio.ensure_future(self._create(key, factory)))
+                self._inflight[key] = flight
+                flight.task.add_done_callback(functools.partial(self._flight_done, key, flight))
+            else:
+                self.stats["coalesced"] += 1
+                LLM_CACHE_EVENTS.labels("coalesced").inc()
+
+            flight.waiters += 1
+            try:
+                return await asyncio.shield(flight.task)
+            except asyncio.CancelledError:
+                # 调用本身被取消（而不是当前请求被取消）时，由当前请求重新发起
+                if flight.task.cancelled():
+                    continue
+                raise
+            finally:
+                flight.waiters -= 1
+                if flight.waiters == 0 and not flight.task.done():
+                    # 所有等待者都已离开，不再需要这次调用
+                    self._forget(key, flight)
+                    flight.task.cancel()
+
+    async def _create(self, key: str, factory: Callable[[], Awaitable[str]]) -> str:
+        value = None
+        if self._store is not None:
+            try:
+                value = await asyncio.to_thread(self._store.get, key)
+            except Exception as e:
+                logging.error(f"读取LLM磁盘缓存失败: {e}")
+        if value is not None:
+            self.stats["disk_hits"] += 1
+            LLM_CACHE_EVENTS.labels("disk_hit").inc()
+        else:
+            self.stats["misses"] += 1
+            LLM_CACHE_EVENTS.labels("miss").inc()
+            value = await factory()
+            if self._store is not None:
+                try:
+                    await asyncio.to_thread(self._store.set, key, value)
+                except Exception as e:
+                    logging.error(f"写入LLM磁盘缓存失败: {e}")
+        self._memory_set(key, value)
+        return value
+
+    def _forget(self, key: str, flight: _Flight) -> None:
+        if self._inflight.get(key) is flight:
+            del self._inflight[key]
+
+    def _flight_done(self, key: str, flight: _Flight, task: "asyncio.Task[str]") -> None:
+        self._forget(key, flight)
+        # 没有等待者时取出异常，避免 "Task exception was never retrieved" 警告
+        if not task.cancelled():
+            task.exception()
+
+    def close(self) -> None:
+        if self._store is not None:
+            self._store.close()
+
+
+def create_cache() -> Optional[CompletionCache]:
+    """根据环境变量创建缓存；LLM_CACHE_ENABLED=0 时返回 None。"""
+    if not CACHE_ENABLED:
+        return None
+    store = None
+    if CACHE_PATH:
+        try:
+            store = SQLiteCompletionStore(CACHE_PATH)
+        except Exception as e:
+            logging.error(f"初始化LLM磁盘缓存失败，仅使用内存缓存: {e}")
+    return CompletionCache(store)
+
+
+# --- 全局缓存实例 ---
+completion_cache = create_cache()
@@ -1,8 +1,10 @@
 import os
+import time
 import logging
-from typing import Optional
+from typing import Optional, List, Dict, Any
 from dotenv import load_dotenv
 from azure.cosmos import CosmosClient
+from api.observability import COSMOS_REQUEST_SECONDS, record_cosmos_charge
 
 # --- 配置 ---
 load_dotenv()
@@ -56,11 +58,14 @@ def get_answer_text(question_id: str, category: str) -> Optional[str]:
     try:
         # 2. 执行查询
         # enable_cross_partition_query 设为 True 是一个好习惯，尽管此查询会命中特定分区
+        start = time.perf_counter()
         items = list(container_client.query_items(
             query=query,
             parameters=parameters,
             enable_cross_partition_query=True
         ))
+        COSMOS_REQUEST_SECONDS.labels("get_answer_text").observe(time.perf_counter() - start)
+        record_cosmos_charge("get_answer_text", container_client.client_connection.last_response_headers)
         
         # 3. 处理查询结果
         if not items:
@@ -78,4 +83,32 @@ def get_answer_text(question_id: str, category: str) -> Optional[str]:
 
     except Exception as e:
         logging.error(f"查询数据库时发生错误: {e}")
-        return None
\ No newline at end of file
+        return None
+
+def load_all_answers() -> List[Dict[str, Any]]:
+    """
+    一次性读取 answers 容器中的全部回答，用于构建内存中的答案目录。
+
+    Returns:
+        List[Dict[str, Any]]: 每条记录包含 'question_id'、'category'、'text'。
+
+    Raises:
+        RuntimeError: 数据库客户端未初始化时抛出；查询异常原样抛出，由调用方决定是否保留旧数据。
+    """
+    if not container_client:
+        raise RuntimeError("数据库客户端未初始化，无法加载答案目录。")
+
+    query = "SELECT c.question_id, c.category, c.text FROM c"
+    start = time.perf_counter()
+    items = []
+    pages = container_client.query_items(
+        query=query,
+        enable_cross_partition_query=True
+    ).by_page()
+    for page in pages:
+        items.extend(page)
+        # 每一页都是一次独立请求，分别累计 RU
+        record_cosmos_charge("load_all_answers", container_client.client_connection.last_response_headers)
+    COSMOS_REQUEST_SECONDS.labels("load_all_answers").observe(time.perf_counter() - start)
+    logging.info(f"从 Cosmos DB 加载了 {len(items)} 条回答")
+    return items
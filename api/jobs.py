@@ -0,0 +1,281 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+from dataclasses import dataclass, field, asdict
+from typing import Any, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from api.models import AssessmentData
+from api.advice_pipeline import (prepare_assessment, iter_advice, assemble_advice_text, load_known_advice,
+                                 save_assessment_state)
+
+# --- 配置 ---
+load_dotenv()
+# 任务状态存储：memory（单进程）/ sqlite（多个 uvicorn worker 共享）
+JOB_STORE_BACKEND = os.getenv("JOB_STORE_BACKEND", "memory")
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", "data/jobs.sqlite3")
+# 每个进程内同时执行的建议生成任务数
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# 等待执行的任务队列容量，满时提交返回 503
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "100"))
+# 相同用户的相同提交在该时间（秒）内会复用已有任务
+JOB_TTL = float(os.getenv("JOB_TTL", "3600"))
+# 未完成的任务超过该时间（秒）没有更新时视为已失效（执行它的进程已退出），不再复用
+JOB_STALE_AFTER = float(os.getenv("JOB_STALE_AFTER", "900"))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class JobQueueFull(Exception):
+    """任务队列已满，调用方应稍后重试。"""
+
+
+@dataclass
+class Job:
+    id: str
+    dedupe_key: str
+    user_id: str
+    status: str = QUEUED
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+    total: int = 0
+    results: Dict[int, Dict[str, Any]] = field(default_factory=dict)
+    advice: Optional[str] = None
+    error: Optional[str] = None
+    reused: int = 0  # 复用该用户上次提交建议的问题数
+
+
+def is_reusable(job: Job, now: float) -> bool:
+    """去重时可以复用的任务：JOB_TTL 内创建、未失败，且未完成的任务最近仍有更新。"""
+    if job.status == FAILED or now - job.created_at >= JOB_TTL:
+        return False
+    return job.status == SUCCEEDED or now - job.updated_at < JOB_STALE_AFTER
+
+
+def dedupe_key(user_id: str, assessment_data: AssessmentData) -> str:
+    """同一 userId 提交相同内容时得到相同的键。"""
+    payload = json.dumps({"userId": user_id, "assessmentData": assessment_data.model_dump(mode="json", exclude_unset=True)},
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class InMemoryJobStore:
+    """进程内任务存储，仅适用于单个 worker。"""
+
+    def __init__(self):
+        self._jobs: Dict[str, Job] = {}
+        self._by_key: Dict[str, str] = {}
+
+    async def create_or_attach(self, key: str, user_id: str) -> Tuple[Job, bool]:
+        existing = self._jobs.get(self._by_key.get(key, ""))
+        if existing is not None and is_reusable(existing, time.time()):
+            return existing, False
+        job = Job(id=uuid.uuid4().hex, dedupe_key=key, user_id=user_id)
+        self._jobs[job.id] = job
+        self._by_key[key] = job.id
+        self._expire()
+        return job, True
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    async def save(self, job: Job) -> None:
+        job.updated_at = time.time()
+        self._jobs[job.id] = job
+
+    def _expire(self) -> None:
+        cutoff = time.time() - JOB_TTL
+        for job_id in [j.id for j in self._jobs.values() if j.updated_at < cutoff and j.status in (SUCCEEDED, FAILED)]:
+            job = self._jobs.pop(job_id)
+            if self._by_key.get(job.dedupe_key) == job_id:
+                del self._by_key[job.dedupe_key]
+
+
+class SQLiteJobStore:
+    """基于 SQLite 的任务存储，多个 uvicorn worker 进程共享同一文件，任一进程都能查询任务状态。"""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, dedupe_key TEXT NOT NULL, "
+            "created_at REAL NOT NULL, status TEXT NOT NULL, data TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_dedupe ON jobs (dedupe_key, created_at)")
+
+    @staticmethod
+    def _load(data: str) -> Job:
+        raw = json.loads(data)
+        raw["results"] = {int(k): v for k, v in raw["results"].items()}
+        return Job(**raw)
+
+    def _create_or_attach(self, key: str, user_id: str) -> Tuple[Job, bool]:
+        with self._lock:
+            # IMMEDIATE 事务保证多个进程同时提交相同内容时只会创建一个任务
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT data FROM jobs WHERE dedupe_key = ? AND status != ? AND created_at > ? "
+                    "ORDER BY created_at DESC",
+                    (key, FAILED, time.time() - JOB_TTL)
+                ).fetchall()
+                # 跳过执行进程已退出、长时间没有更新的未完成任务
+                reusable = [job for job in map(self._load, (row[0] for row in rows))
+                            if is_reusable(job, time.time())]
+                if reusable:
+                    self._conn.execute("COMMIT")
+                    return reusable[0], False
+                job = Job(id=uuid.uuid4().hex, dedupe_key=key, user_id=user_id)
+                self._conn.execute(
+                    "INSERT INTO jobs (id, dedupe_key, created_at, status, data) VALUES (?, ?, ?, ?, ?)",
+                    (job.id, key, job.created_at, job.status, json.dumps(asdict(job), ensure_ascii=False))
+                )
+                self._conn.execute("DELETE FROM jobs WHERE created_at < ? AND status IN (?, ?)",
+                                   (time.time() - JOB_TTL, SUCCEEDED, FAILED))
+                self._conn.execute("COMMIT")
+                return job, True
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._load(row[0]) if row else None
+
+    def _save(self, job: Job) -> None:
+        job.updated_at = time.time()
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET status = ?, data = ? WHERE id = ?",
+                               (job.status, json.dumps(asdict(job), ensure_ascii=False), job.id))
+
+    async def create_or_attach(self, key: str, user_id: str) -> Tuple[Job, bool]:
+        return await asyncio.to_thread(self._create_or_attach, key, user_id)
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        return await asyncio.to_thread(self._get, job_id)
+
+    async def save(self, job: Job) -> None:
+        await asyncio.to_thread(self._save, job)
+
+
+class JobManager:
+    """
+    建议生成任务的提交与执行。
+
+    提交时按 userId + 内容哈希去重并立即返回任务；固定数量的后台 worker 从有界队列中取任务，
+    执行 加权 → 检索 → LLM → 拼接 流程，每完成一题就写入一次部分结果。
+    """
+
+    def __init__(self, store, workers: int = JOB_WORKERS, queue_size: int = JOB_QUEUE_SIZE):
+        self.store = store
+        self._workers = workers
+        self._queue_size = queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        self._queue = asyncio.Queue(maxsize=self._queue_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self._workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # 未完成的任务标记为失败，否则重启后相同提交会一直复用一个不会完成的任务；执行中的任务由 worker 标记
+        while self._queue is not None and not self._queue.empty():
+            job, _ = self._queue.get_nowait()
+            await self._fail(job, "服务关闭，任务未完成")
+
+    async def submit(self, user_id: str, assessment_data: AssessmentData) -> Tuple[Job, bool]:
+        """
+        提交任务；同一用户的相同提交复用已有任务。
+
+        Returns:
+            Tuple[Job, bool]: (任务, 是否新建)。
+
+        Raises:
+            JobQueueFull: 等待队列已满。
+        """
+        if self._queue is None:
+            raise RuntimeError("JobManager 尚未启动")
+        if self._queue.full():
+            raise JobQueueFull(f"任务队列已满（{self._queue_size}）")
+        job, created = await self.store.create_or_attach(dedupe_key(user_id, assessment_data), user_id)
+        if created:
+            try:
+                self._queue.put_nowait((job, assessment_data))
+            except asyncio.QueueFull:
+                job.status, job.error = FAILED, "任务队列已满"
+                await self.store.save(job)
+                raise JobQueueFull(f"任务队列已满（{self._queue_size}）")
+        return job, created
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        return await self.store.get(job_id)
+
+    async def _run(self, job: Job, assessment_data: AssessmentData) -> None:
+        job.status = RUNNING
+        await self.store.save(job)
+        prepared = await prepare_assessment(assessment_data)
+        known = await load_known_advice(job.user_id, prepared)
+        job.total = len(prepared.questions)
+        job.reused = len(known)
+        await self.store.save(job)
+        results = [None] * job.total
+        async for idx, item in iter_advice(prepared, known=known):
+            results[idx] = item
+            job.results[idx] = item.model_dump()
+            await self.store.save(job)
+        await save_assessment_state(job.user_id, prepared, results)
+        job.advice = assemble_advice_text(results)
+        job.status = SUCCEEDED
+        await self.store.save(job)
+
+    async def _fail(self, job: Job, error: str) -> None:
+        job.status, job.error = FAILED, error
+        try:
+            await self.store.save(job)
+        except Exception as e:
+            # 保存失败时任务停留在未完成状态，超过 JOB_STALE_AFTER 后不再被去重复用
+            logging.error(f"更新任务 {job.id} 状态失败: {e}")
+
+    async def _worker(self) -> None:
+        while True:
+            job, assessment_data = await self._queue.get()
+            try:
+                await self._run(job, assessment_data)
+            except asyncio.CancelledError:
+                await self._fail(job, "服务关闭，任务未完成")
+                raise
+            except Exception as e:
+                logging.error(f"建议生成任务 {job.id} 失败: {e}")
+                await self._fail(job, str(e))
+            finally:
+                self._queue.task_done()
+
+
+def create_store():
+    if JOB_STORE_BACKEND == "sqlite":
+        return SQLiteJobStore(JOB_STORE_PATH)
+    if JOB_STORE_BACKEND == "memory":
+        return InMemoryJobStore()
+    raise ValueError(f"未知的 JOB_STORE_BACKEND: {JOB_STORE_BACKEND}")
+
+
+# --- 全局任务管理器 ---
+# 在应用启动（lifespan）时调用 job_manager.start()，关闭时调用 await job_manager.stop()。
+job_manager = JobManager(create_store())
@@ -0,0 +1,379 @@
+import os
+import json
+import math
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+import openai
+from dotenv import load_dotenv
+from api.observability import LLM_CONCURRENCY_LIMIT, LLM_HEDGES, LLM_RETRIES, LLM_THROTTLES
+
+# --- 配置 ---
+load_dotenv()
+API_VERSION = "2024-02-15-preview"
+# 多个 deployment：逗号分隔的部署名（共用 AZURE_OPENAI_ENDPOINT / AZURE_OPENAI_API_KEY），
+# 或 JSON 数组 [{"deployment": ..., "endpoint": ..., "api_key": ..., "rpm": ..., "tpm": ...}]；
+# 未设置时只使用 AZURE_OPENAI_DEPLOYMENT
+DEPLOYMENTS_CONFIG = os.getenv("AZURE_OPENAI_DEPLOYMENTS", "")
+# 每个 deployment 每分钟的请求数 / token 数额度，<= 0 表示不限制（可在 JSON 配置中按 deployment 覆盖）
+RPM_LIMIT = int(os.getenv("LLM_RPM_LIMIT", "0"))
+TPM_LIMIT = int(os.getenv("LLM_TPM_LIMIT", "0"))
+# 可重试错误（429、5xx、连接错误/超时）的最大重试次数
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+# 指数退避的基数和上限（秒），实际等待时间在 [0, min(上限, 基数 × 2^重试次数)] 内随机
+BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+# 每个 deployment 的自适应并发上限范围；从最大值开始，遇到 429 减半，之后每次成功缓慢增加
+MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY_PER_DEPLOYMENT", "32"))
+MIN_CONCURRENCY = int(os.getenv("LLM_MIN_CONCURRENCY_PER_DEPLOYMENT", "1"))
+# 单次调用耗时超过该值（秒）时视为过载并降低并发上限，<= 0 表示只根据 429 调整
+LATENCY_TARGET = float(os.getenv("LLM_LATENCY_TARGET", "0"))
+# 调用耗时超过同类调用最近耗时的该百分位时，向另一个 deployment 发出对冲请求；<= 0 关闭对冲
+HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+# 同类调用至少有这么多样本后才开始对冲
+HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+
+# 两次降低并发上限之间的最小间隔（秒），避免同一波 429 把上限连续减到最小
+DECREASE_INTERVAL = 1.0
+THROTTLE_FACTOR = 0.5
+SLOW_FACTOR = 0.9
+
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+
+def retry_after_seconds(response: Any) -> Optional[float]:
+    """读取 429 响应中的 retry-after-ms / Retry-After（秒数格式）。"""
+    if response is None:
+        return None
+    for name, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = response.headers.get(name)
+        if value:
+            try:
+                return max(0.0, float(value) * scale)
+            except ValueError:
+                continue
+    return None
+
+
+def backoff_delay(attempt: int) -> float:
+    """full jitter 指数退避。"""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+def estimate_tokens(messages: List[Dict[str, str]], max_tokens: int) -> int:
+    # 与 Azure 的限流估算方式一致：按 prompt 长度估算输入 token，再加上 max_tokens
+    return sum(len(m.get("content") or "") for m in messages) // 4 + max_tokens
+
+
+def _retry_reason(error: Exception) -> str:
+    if isinstance(error, openai.RateLimitError):
+        return "rate_limited"
+    if isinstance(error, openai.InternalServerError):
+        return "server_error"
+    return "connection"
+
+
+class RateBudget:
+    """
+    每分钟额度的令牌桶（RPM 或 TPM），按时间连续补充；per_minute <= 0 表示不限制。
+
+    Azure 按 1 秒或 10 秒的短窗口执行限流，因此桶容量（允许的突发量）只取 1 秒的额度，
+    任意窗口内发出的量都不会明显超过按比例分摊的额度。
+    单次用量超过桶容量的调用在桶满时即可发出，但按实际用量扣减，余额变为负数（欠额），
+    之后的调用要等欠额按速率补回后才能发出，长期发出的量不会超过额度。
+    """
+
+    def __init__(self, per_minute: float):
+        self.rate = float(per_minute) / 60
+        self.capacity = max(self.rate, 1.0)
+        # 从空桶开始：进程刚启动时可能仍在前一个进程用掉的额度窗口内
+        self._level = 0.0
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """距离有足够额度还需等待的秒数。"""
+        if self.rate <= 0:
+            return 0.0
+        self._refill(now)
+        # 单次用量超过桶容量时只需等到桶满，避免永远等待；欠额会先计入等待时间
+        needed = min(amount, self.capacity)
+        if self._level >= needed:
+            return 0.0
+        return (needed - self._level) / self.rate
+
+    def consume(self, amount: float, now: float) -> None:
+        # 按实际用量扣减，可以扣成负数（欠额）
+        if self.rate > 0:
+            self._refill(now)
+            self._level -= amount
+
+
+class LatencyWindow:
+    """同类调用最近的成功耗时，用于计算对冲阈值。"""
+
+    def __init__(self, size: int = 500, refresh_every: int = 16):
+        self._samples = deque(maxlen=size)
+        self._refresh_every = refresh_every
+        self._sorted: List[float] = []
+        self._added = 0
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+        self._added += 1
+
+    def percentile(self, pct: float) -> float:
+        # 每新增一批样本才重新排序
+        if self._added >= self._refresh_every or len(self._sorted) != len(self._samples):
+            self._sorted = sorted(self._samples)
+            self._added = 0
+        idx = min(len(self._sorted) - 1, int(math.ceil(pct / 100 * len(self._sorted))) - 1)
+        return self._sorted[max(idx, 0)]
+
+
+@dataclass
+class Deployment:
+    """一个 Azure OpenAI 部署及其限流状态。"""
+    name: str
+    client: Any
+    rpm: RateBudget
+    tpm: RateBudget
+    limit: float = MAX_CONCURRENCY
+    inflight: int = 0
+    last_decrease: float = field(default=0.0, repr=False)
+
+    def wait_time(self, tokens: int, now: float) -> float:
+        """距离可以在该部署上发起调用还需等待的秒数；并发已满时为 inf（等待其它调用结束）。"""
+        if self.inflight >= int(self.limit):
+            return math.inf
+        return max(self.rpm.wait_time(1, now), self.tpm.wait_time(tokens, now), 0.0)
+
+    def decrease(self, factor: float, now: float) -> None:
+        if now - self.last_decrease < DECREASE_INTERVAL:
+            return
+        self.last_decrease = now
+        self.limit = max(MIN_CONCURRENCY, self.limit * factor)
+        LLM_CONCURRENCY_LIMIT.labels(self.name).set(self.limit)
+
+    def increase(self) -> None:
+        # 加性增长：大约每完成 limit 次成功调用，上限加 1
+        if self.limit < MAX_CONCURRENCY:
+            self.limit = min(MAX_CONCURRENCY, self.limit + 1 / self.limit)
+            LLM_CONCURRENCY_LIMIT.labels(self.name).set(self.limit)
+
+
+class LLMDispatcher:
+    """
+    Azure OpenAI 调用调度：在多个 deployment 间路由，按 RPM/TPM 额度和自适应并发上限排队，
+    对 429/5xx/连接错误做带抖动的指数退避重试（429 遵守 Retry-After），
+    并在调用耗时超过同类调用的百分位阈值时向另一个 deployment 发出对冲请求，取先返回的结果。
+    """
+
+    def __init__(self, deployments: List[Deployment]):
+        if not deployments:
+            raise ValueError("至少需要配置一个 Azure OpenAI deployment")
+        self.deployments = deployments
+        self._latency: Dict[Any, LatencyWindow] = {}
+        # 在首次使用时创建，确保绑定到 uvicorn 的事件循环（Python 3.9 兼容）
+        self._changed: Optional[asyncio.Event] = None
+        for deployment in deployments:
+            LLM_CONCURRENCY_LIMIT.labels(deployment.name).set(deployment.limit)
+
+    def _changed_event(self) -> asyncio.Event:
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        return self._changed
+
+    def _notify(self) -> None:
+        # 唤醒所有等待者重新检查额度；之后的等待使用新的 Event
+        event = self._changed_event()
+        self._changed = asyncio.Event()
+        event.set()
+
+    async def _acquire(self, tokens: int, not_before: Dict[str, float], exclude: Optional[Deployment] = None,
+                       wait: bool = True) -> Optional[Deployment]:
+        """
+        选出最早可用的部署（相同时选负载最低的）并占用一个并发名额；wait=False 时不可用则返回 None。
+
+        not_before 为本次调用在各部署上收到 429 后的 Retry-After 截止时间。
+        """
+        while True:
+            changed = self._changed_event()
+            now = time.monotonic()
+            best, best_key = None, (math.inf, math.inf)
+            for deployment in self.deployments:
+                if deployment is exclude:
+                    continue
+                delay = max(deployment.wait_time(tokens, now), not_before.get(deployment.name, 0.0) - now)
+                key = (delay, deployment.inflight / deployment.limit)
+                if key < best_key:
+                    best, best_key = deployment, key
+            delay = best_key[0]
+            if best is not None and delay <= 0:
+                best.inflight += 1
+                best.rpm.consume(1, now)
+                best.tpm.consume(tokens, now)
+                return best
+            if not wait:
+                return None
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=None if math.isinf(delay) else delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def _release(self, deployment: Deployment, outcome: str, latency: float) -> None:
+        now = time.monotonic()
+        deployment.inflight -= 1
+        if outcome == "ok":
+            if LATENCY_TARGET > 0 and latency > LATENCY_TARGET:
+                deployment.decrease(SLOW_FACTOR, now)
+            else:
+                deployment.increase()
+        elif outcome == "throttled":
+            LLM_THROTTLES.labels(deployment.name).inc()
+            deployment.decrease(THROTTLE_FACTOR, now)
+        self._notify()
+
+    async def _call(self, deployment: Deployment, messages: List[Dict[str, str]], params: Dict[str, Any],
+                    window: LatencyWindow, not_before: Dict[str, float]) -> Any:
+        start = time.monotonic()
+        outcome = "error"
+        try:
+            response = await deployment.client.chat.completions.create(
+                model=deployment.name, messages=messages, **params
+            )
+            outcome = "ok"
+            return response
+        except openai.RateLimitError as e:
+            outcome = "throttled"
+            # 本次调用在 Retry-After 之前不再发往该部署，有其它可用部署时立即改用
+            retry_after = retry_after_seconds(e.response)
+            not_before[deployment.name] = time.monotonic() + (retry_after if retry_after is not None
+                                                              else backoff_delay(1))
+            raise
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            latency = time.monotonic() - start
+            if outcome == "ok":
+                window.add(latency)
+            self._release(deployment, outcome, latency)
+
+    def _hedge_delay(self, window: LatencyWindow) -> Optional[float]:
+        if HEDGE_PERCENTILE <= 0 or len(self.deployments) < 2 or len(window) < HEDGE_MIN_SAMPLES:
+            return None
+        return window.percentile(HEDGE_PERCENTILE)
+
+    async def _hedged_call(self, messages: List[Dict[str, str]], params: Dict[str, Any], tokens: int,
+                           window: LatencyWindow, not_before: Dict[str, float]) -> Any:
+        primary = await self._acquire(tokens, not_before)
+        delay = self._hedge_delay(window)
+        if delay is None:
+            return await self._call(primary, messages, params, window, not_before)
+
+        tasks = [asyncio.ensure_future(self._call(primary, messages, params, window, not_before))]
+        try:
+            await asyncio.wait(tasks, timeout=delay)
+            if not tasks[0].done():
+                # 只在另一个部署当前有空闲额度时对冲，不为对冲请求排队
+                secondary = await self._acquire(tokens, not_before, exclude=primary, wait=False)
+                if secondary is not None:
+                    LLM_HEDGES.labels("launched").inc()
+                    tasks.append(asyncio.ensure_future(
+                        self._call(secondary, messages, params, window, not_before)
+                    ))
+
+            pending, error = set(tasks), None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not tasks[0]:
+                            LLM_HEDGES.labels("won").inc()
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def complete(self, messages: List[Dict[str, str]], **params: Any) -> Any:
+        """
+        发起一次 chat completion 调用，返回 SDK 的响应对象。
+
+        Args:
+            messages (List[Dict[str, str]]): system/user 消息列表。
+            **params: temperature / max_tokens 等调用参数。
+
+        Raises:
+            openai.OpenAIError: 不可重试的错误，或重试 LLM_MAX_RETRIES 次后仍失败。
+        """
+        max_tokens = params.get("max_tokens") or 0
+        tokens = estimate_tokens(messages, max_tokens)
+        # 按 max_tokens 区分调用类型（逐题 / 批量），分别统计耗时分布
+        window = self._latency.setdefault(max_tokens, LatencyWindow())
+        not_before: Dict[str, float] = {}
+        attempt = 0
+        while True:
+            try:
+                return await self._hedged_call(messages, params, tokens, window, not_before)
+            except RETRYABLE_ERRORS as e:
+                if attempt >= MAX_RETRIES:
+                    raise
+                attempt += 1
+                LLM_RETRIES.labels(_retry_reason(e)).inc()
+                logging.warning(f"LLM调用失败，第 {attempt} 次重试: {e}")
+                # 429 的 Retry-After 已记入 not_before，由 _acquire 等待或改用其它部署
+                if not isinstance(e, openai.RateLimitError):
+                    await asyncio.sleep(backoff_delay(attempt))
+
+
+def load_deployment_configs() -> List[Dict[str, Any]]:
+    raw = DEPLOYMENTS_CONFIG.strip()
+    if not raw:
+        return [{"deployment": os.getenv("AZURE_OPENAI_DEPLOYMENT")}]
+    if raw.startswith("["):
+        return json.loads(raw)
+    return [{"deployment": name.strip()} for name in raw.split(",") if name.strip()]
+
+
+def create_dispatcher() -> LLMDispatcher:
+    clients = {}
+    deployments = []
+    for config in load_deployment_configs():
+        endpoint = config.get("endpoint") or os.getenv("AZURE_OPENAI_ENDPOINT")
+        api_key = config.get("api_key") or os.getenv("AZURE_OPENAI_API_KEY")
+        if (endpoint, api_key) not in clients:
+            # 重试由调度器负责，关闭 SDK 自带的重试
+            clients[(endpoint, api_key)] = openai.AsyncAzureOpenAI(
+                api_key=api_key,
+                azure_endpoint=endpoint,
+                api_version=API_VERSION,
+                max_retries=0
+            )
+        deployments.append(Deployment(
+            name=config["deployment"],
+            client=clients[(endpoint, api_key)],
+            rpm=RateBudget(config.get("rpm", RPM_LIMIT)),
+            tpm=RateBudget(config.get("tpm", TPM_LIMIT))
+        ))
+    return LLMDispatcher(deployments)
+
+
+# --- 全局调度器 ---
+try:
+    dispatcher = create_dispatcher()
+except Exception as e:
+    dispatcher = None
+    logging.error(f"Failed to initialize Azure OpenAI client: {e}")
@@ -0,0 +1,186 @@
+import os
+import time
+import asyncio
+import logging
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, List, Dict, Optional, Tuple
+from dotenv import load_dotenv
+from api.completion_cache import completion_cache, make_key
+from api.llm_dispatcher import dispatcher
+from api.observability import LLM_CALL_SECONDS, LLM_FALLBACKS, LLM_TOKENS, add_request_timing
+
+# --- 配置 ---
+load_dotenv()
+DEPLOYMENT = os.getenv("AZURE_OPENAI_DEPLOYMENT")
+TEMPERATURE = 0.7
+MAX_TOKENS = 1024  # 增加token数量以处理更多内容
+
+# 单个请求内同时进行的LLM调用上限
+MAX_CONCURRENCY_PER_REQUEST = int(os.getenv("LLM_MAX_CONCURRENCY_PER_REQUEST", "8"))
+# 整个进程内同时进行的LLM调用上限（所有请求共享）
+MAX_CONCURRENCY_GLOBAL = int(os.getenv("LLM_MAX_CONCURRENCY_GLOBAL", "32"))
+# 单个问题的LLM调用超时时间（秒），从取得并发名额后开始计时，包含调度器的限流等待和重试；
+# 等待并发名额的时间不计入，超时后使用失败兜底文本
+CALL_TIMEOUT = float(os.getenv("LLM_CALL_TIMEOUT", "60"))
+
+FALLBACK_PREFIX = "LLM生成失败"
+
+# 进程级信号量在首次使用时创建，确保绑定到 uvicorn 的事件循环（Python 3.9 兼容）
+_global_semaphore: Optional[asyncio.Semaphore] = None
+
+
+def _get_global_semaphore() -> asyncio.Semaphore:
+    global _global_semaphore
+    if _global_semaphore is None:
+        _global_semaphore = asyncio.Semaphore(MAX_CONCURRENCY_GLOBAL)
+    return _global_semaphore
+
+
+def completion_key(messages: List[Dict[str, str]], **params: Any) -> str:
+    """补全缓存和预生成建议库共用的键：完整消息和模型参数的哈希，prompt 模板或检索文本变化时键随之变化。"""
+    return make_key(messages, model=DEPLOYMENT, **{"temperature": TEMPERATURE, "max_tokens": MAX_TOKENS, **params})
+
+
+def build_messages(system_prompt: str, user_prompt: str) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+
+@dataclass
+class TokenUsage:
+    """一次建议请求内累计的LLM调用次数和 token 用量（缓存命中不计入）。"""
+    calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def add(self, usage: Any) -> None:
+        self.calls += 1
+        if usage is not None:
+            self.prompt_tokens += usage.prompt_tokens or 0
+            self.completion_tokens += usage.completion_tokens or 0
+
+
+_current_usage: ContextVar[Optional[TokenUsage]] = ContextVar("llm_token_usage", default=None)
+
+
+def track_usage() -> TokenUsage:
+    """为当前请求开始统计 token 用量；之后在当前上下文中创建的任务都会计入返回的对象。"""
+    usage = TokenUsage()
+    _current_usage.set(usage)
+    return usage
+
+
+def new_request_limiter(max_concurrency: Optional[int] = None) -> asyncio.Semaphore:
+    return asyncio.Semaphore(max_concurrency or MAX_CONCURRENCY_PER_REQUEST)
+
+
+async def complete(messages: List[Dict[str, str]], **params: Any) -> str:
+    """
+    发起一次 chat completion 调用并返回文本内容。
+
+    Args:
+        messages (List[Dict[str, str]]): system/user 消息列表。
+        **params: 覆盖默认的 temperature / max_tokens 等调用参数。
+
+    Returns:
+        str: LLM 返回的文本。
+    """
+    if dispatcher is None:
+        raise RuntimeError("Azure OpenAI 客户端未初始化")
+    # 由调度器选择 deployment，处理限流、重试和对冲
+    response = await dispatcher.complete(messages, **{"temperature": TEMPERATURE, "max_tokens": MAX_TOKENS, **params})
+    if response.usage is not None:
+        LLM_TOKENS.labels("prompt").inc(response.usage.prompt_tokens or 0)
+        LLM_TOKENS.labels("completion").inc(response.usage.completion_tokens or 0)
+    usage = _current_usage.get()
+    if usage is not None:
+        usage.add(response.usage)
+    return response.choices[0].message.content
+
+
+async def _bounded_complete(messages: List[Dict[str, str]], request_semaphore: asyncio.Semaphore,
+                            validate: Optional[Callable[[str], Any]], timeout: Optional[float],
+                            params: Dict[str, Any]) -> str:
+    # 先占用请求级名额，再占用进程级名额，保证单个大请求不会占满全局并发
+    async with request_semaphore:
+        async with _get_global_semaphore():
+            start = time.perf_counter()
+            outcome = "error"
+            try:
+                # 超时只覆盖调用本身（含限流等待和重试），不包含上面等待并发名额的时间
+                content = await asyncio.wait_for(complete(messages, **params), timeout=timeout or CALL_TIMEOUT)
+                outcome = "ok"
+            except asyncio.TimeoutError:
+                outcome = "timeout"
+                raise
+            finally:
+                elapsed = time.perf_counter() - start
+                LLM_CALL_SECONDS.labels(outcome).observe(elapsed)
+                add_request_timing("llm_call", elapsed)
+    if validate is not None:
+        # 校验失败时抛出异常，结果不会进入缓存
+        validate(content)
+    return content
+
+
+async def cached_complete(messages: List[Dict[str, str]], request_semaphore: asyncio.Semaphore,
+                          validate: Optional[Callable[[str], Any]] = None, timeout: Optional[float] = None,
+                          **params: Any) -> str:
+    """
+    经过补全缓存和并发限制的 LLM 调用，失败、超时或校验不通过时抛出异常。
+
+    Args:
+        messages (List[Dict[str, str]]): system/user 消息列表。
+        request_semaphore (asyncio.Semaphore): 请求级并发限制，见 new_request_limiter。
+        validate: 可选的结果校验函数，抛出异常表示结果无效。
+        timeout (Optional[float]): 调用超时（秒），默认 LLM_CALL_TIMEOUT。
+        **params: 覆盖默认的调用参数，同时参与缓存键计算。
+    """
+    if completion_cache is None:
+        return await _bounded_complete(messages, request_semaphore, validate, timeout, params)
+    # 缓存命中时不占用并发名额；失败结果不会写入缓存
+    key = completion_key(messages, **params)
+    return await completion_cache.get_or_create(
+        key, lambda: _bounded_complete(messages, request_semaphore, validate, timeout, params)
+    )
+
+
+async def complete_or_fallback(messages: List[Dict[str, str]], request_semaphore: asyncio.Semaphore) -> str:
+    """单个问题的LLM调用，失败或超时时返回 "LLM生成失败: ..." 兜底文本。"""
+    try:
+        return await cached_complete(messages, request_semaphore)
+    except asyncio.TimeoutError:
+        logging.warning(f"LLM调用超时（{CALL_TIMEOUT}s）")
+        LLM_FALLBACKS.labels("timeout").inc()
+        return f"{FALLBACK_PREFIX}: 调用超时（{CALL_TIMEOUT}s）"
+    except Exception as e:
+        LLM_FALLBACKS.labels("error").inc()
+        return f"{FALLBACK_PREFIX}: {e}"
+
+
+async def iter_completed(message_batches: List[List[Dict[str, str]]],
+                         max_concurrency: Optional[int] = None) -> AsyncIterator[Tuple[int, str]]:
+    """
+    并发生成多个问题的建议，每完成一个就立即产出 (输入下标, 建议文本)。
+
+    迭代器提前关闭（例如客户端断开流式连接）时，会取消尚未完成的调用。
+    """
+    request_semaphore = new_request_limiter(max_concurrency)
+
+    async def run(idx: int, messages: List[Dict[str, str]]) -> Tuple[int, str]:
+        return idx, await complete_or_fallback(messages, request_semaphore)
+
+    tasks = [asyncio.ensure_future(run(idx, messages)) for idx, messages in enumerate(message_batches)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -1,10 +1,30 @@
-from pydantic import BaseModel, Extra
-from typing import Dict, Any
+from pydantic import BaseModel, ConfigDict, TypeAdapter
+from typing import Dict, Any, List, Optional
+
+class ServiceOfferingAnswer(BaseModel):
+    """serviceOffering 中的一项：加权规则题（question_name/anwserselete）或业务画像字段（text）。"""
+    model_config = ConfigDict(extra="allow")
+    question_name: Optional[str] = None
+    anwserselete: Optional[str] = None
+    text: Optional[str] = None
+
+class QuestionEntry(BaseModel):
+    """评估分组下的一道题。"""
+    model_config = ConfigDict(extra="allow")
+    question: str = ""
+    score: float = 0
+    category: str = ""
+    catmapping: str = ""  # 阶段：Profitable / Repeatable / Scalable
 
 class AssessmentData(BaseModel):
-    serviceOffering: Dict[str, Any]
-    class Config:
-        extra = Extra.allow  # 允许其它任意字段
+    # 除 serviceOffering 外的字段均为评估分组：{分组名: {题目key: QuestionEntry}}
+    model_config = ConfigDict(extra="allow")
+    __pydantic_extra__: Dict[str, Dict[str, QuestionEntry]]
+    serviceOffering: Dict[str, ServiceOfferingAnswer]
+
+    def questions(self) -> List[QuestionEntry]:
+        """按提交顺序返回所有分组下的题目。"""
+        return [q for section in (self.model_extra or {}).values() for q in section.values()]
 
 class LLMAdviceRequest(BaseModel):
     userId: str
@@ -14,7 +34,59 @@ class SaveReportResponse(BaseModel):
     status: str
     message: str
     timestamp: str
+    reportId: Optional[str] = None
 
 class LLMAdviceResponse(BaseModel):
     advice: str
     timestamp: str
+    # 与该用户上次提交相比未变化、直接复用上次建议的问题数，以及重新生成的问题数
+    reusedCount: int = 0
+    regeneratedCount: int = 0
+
+class AdviceResult(BaseModel):
+    catmapping: str
+    category: str
+    question: str
+    advice: str
+
+class AdviceEvent(BaseModel):
+    """流式接口中的单题结果事件。"""
+    index: int
+    question_id: str
+    phase: str
+    category: str
+    question: str
+    advice: str
+
+class AdviceSummary(BaseModel):
+    """流式接口最后的汇总事件。"""
+    phases: List[Dict[str, Any]]
+    advice: str
+    timestamp: str
+    reusedCount: int = 0
+    regeneratedCount: int = 0
+
+class JobAdviceResult(AdviceResult):
+    index: int
+
+class JobSubmitResponse(BaseModel):
+    jobId: str
+    status: str
+    deduplicated: bool
+
+class JobStatusResponse(BaseModel):
+    jobId: str
+    status: str
+    total: int
+    completed: int
+    results: List[JobAdviceResult]
+    advice: Optional[str] = None
+    error: Optional[str] = None
+    reusedCount: int = 0
+    regeneratedCount: int = 0
+    createdAt: str
+    updatedAt: str
+
+# 流式事件的序列化器，导入时构建一次，直接输出 UTF-8 JSON 字节
+advice_event_adapter = TypeAdapter(AdviceEvent)
+advice_summary_adapter = TypeAdapter(AdviceSummary)
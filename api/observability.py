@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY,
+                               generate_latest)
+from prometheus_client import multiprocess
+
+# 多个 uvicorn worker 时需设置 PROMETHEUS_MULTIPROC_DIR（每次启动前清空该目录），/metrics 会汇总所有进程的数据
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+# 日志格式：json（结构化日志，默认）/ text
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP 请求耗时", ["method", "route", "status"], buckets=STAGE_BUCKETS
+)
+STAGE_SECONDS = Histogram(
+    "advice_stage_duration_seconds", "建议生成各阶段耗时", ["stage"], buckets=STAGE_BUCKETS
+)
+LLM_CALL_SECONDS = Histogram(
+    "llm_call_duration_seconds", "单次LLM调用耗时", ["outcome"], buckets=STAGE_BUCKETS
+)
+LLM_TOKENS = Counter("llm_tokens_total", "LLM token 用量", ["kind"])
+LLM_RETRIES = Counter("llm_retries_total", "LLM调用重试次数", ["reason"])
+LLM_FALLBACKS = Counter("llm_fallbacks_total", "使用“LLM生成失败”兜底文本的次数", ["reason"])
+LLM_CACHE_EVENTS = Counter("llm_cache_events_total", "LLM补全缓存事件", ["event"])
+ADVICE_STORE_LOOKUPS = Counter("advice_store_lookups_total", "预生成建议库按题查询结果", ["result"])
+ADVICE_REASSESSMENT_QUESTIONS = Counter(
+    "advice_reassessment_questions_total", "重新提交时逐题复用上次建议（reused）或重新生成的原因", ["outcome"]
+)
+LLM_THROTTLES = Counter("llm_throttled_total", "Azure OpenAI 返回 429 的次数", ["deployment"])
+LLM_HEDGES = Counter("llm_hedges_total", "对冲请求次数（launched 发出 / won 先于原请求返回）", ["outcome"])
+# 多进程模式下汇总为所有 worker 的并发上限之和
+LLM_CONCURRENCY_LIMIT = Gauge("llm_concurrency_limit", "各 deployment 当前的自适应并发上限", ["deployment"],
+                              multiprocess_mode="livesum")
+COSMOS_REQUEST_CHARGE = Counter("cosmos_request_charge_total", "Cosmos DB 请求消耗的 RU", ["operation"])
+COSMOS_REQUEST_SECONDS = Histogram(
+    "cosmos_request_duration_seconds", "Cosmos DB 请求耗时", ["operation"], buckets=STAGE_BUCKETS
+)
+
+# 当前请求的阶段耗时记录 [(名称, 秒)]，由 ServerTimingMiddleware 在请求开始时创建
+_request_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("request_timings", default=None)
+
+
+def add_request_timing(name: str, seconds: float) -> None:
+    """只计入当前请求的 Server-Timing（不在请求内时忽略）。"""
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+def record_timing(name: str, seconds: float) -> None:
+    """记录一个阶段的耗时：写入 Prometheus 直方图，并计入当前请求的 Server-Timing。"""
+    STAGE_SECONDS.labels(name).observe(seconds)
+    add_request_timing(name, seconds)
+
+
+@contextmanager
+def span(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_timing(name, time.perf_counter() - start)
+
+
+def server_timing_header(timings: List[Tuple[str, float]]) -> str:
+    """同名记录合并为一项，dur 为累计毫秒数，多次时在 desc 中注明次数。"""
+    totals: Dict[str, List[float]] = {}
+    for name, seconds in timings:
+        totals.setdefault(name, []).append(seconds)
+    entries = []
+    for name, values in totals.items():
+        entry = f"{name};dur={sum(values) * 1000:.1f}"
+        if len(values) > 1:
+            entry += f';desc="n={len(values)}"'
+        entries.append(entry)
+    return ", ".join(entries)
+
+
+def record_cosmos_charge(operation: str, headers: Optional[Dict[str, Any]]) -> None:
+    if not headers:
+        return
+    try:
+        COSMOS_REQUEST_CHARGE.labels(operation).inc(float(headers.get("x-ms-request-charge", 0)))
+    except (TypeError, ValueError):
+        pass
+
+
+class ServerTimingMiddleware:
+    """
+    ASGI 中间件：统计 HTTP 请求耗时，并把请求内记录的阶段耗时写入 Server-Timing 响应头。
+
+    流式响应在开始发送时就写出响应头，因此只包含流开始前完成的阶段。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings: List[Tuple[str, float]] = []
+        token = _request_timings.set(timings)
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                total = time.perf_counter() - start
+                header = server_timing_header(timings + [("total", total)])
+                message = {**message, "headers": list(message.get("headers", [])) + [
+                    (b"server-timing", header.encode("latin-1"))
+                ]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.labels(
+                scope["method"], getattr(route, "path", "unmatched"), str(status["code"])
+            ).observe(time.perf_counter() - start)
+
+
+def metrics_payload() -> Tuple[bytes, str]:
+    """生成 Prometheus 文本格式的指标；多进程模式下汇总所有 worker。"""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行 JSON；log_event 传入的字段会展开到顶层。"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.utcfromtimestamp(record.created).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "pid": record.process,
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging() -> None:
+    handler = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(LOG_LEVEL)
+
+
+_event_logger = logging.getLogger("advice")
+
+
+def log_event(event: str, level: int = logging.INFO, **fields: Any) -> None:
+    """输出一条结构化事件日志。"""
+    _event_logger.log(level, event, extra={"fields": {"event": event, **fields}})
@@ -0,0 +1,246 @@
+"""
+离线预生成建议：枚举常见的 业务画像 × 问题 × 建议类型 组合，调用LLM生成建议并写入预生成建议库，
+线上请求命中后不再调用LLM。可随时中断后重跑，库中已是最新的条目会跳过。
+
+    python -m api.pregenerate_advice --config pregenerate.json
+    python -m api.pregenerate_advice --reports data/reports.sqlite3 --min-count 3 --all-categories
+    python -m api.pregenerate_advice --reports cosmos --min-count 3   # 读取 Cosmos 中保存的报告
+    python -m api.pregenerate_advice --prune     # 清理 prompt 模板或答案目录变化后失效的条目
+
+--config 为 JSON 文件：
+    {
+      "profiles": [{"industry": "SaaS", "business_challenge": "...", "service_type": "...", "revenue_type": "..."}],
+      "profile_values": {"industry": ["SaaS", "Healthcare"], ...},   # 与 profiles 二选一，取笛卡尔积
+      "questions": [{"question_id": "question_00", "question": "How does your team ..."}],
+      "categories": ["Start_Doing", "Do_More", "Keep_Doing"]          # 可选，默认全部
+    }
+--reports 读取已保存的报告（.jsonl 或 SQLite 文件，或 "cosmos" 表示 REPORT_CONTAINER_NAME 容器，见 api/report_store.py），
+按实际出现次数从高到低生成。
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import itertools
+import logging
+from collections import Counter
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from pydantic import ValidationError
+from api.models import AssessmentData, QuestionEntry
+from api.prompts import SYSTEM_PROMPT_TEMPLATE
+from api.scoring import START_DOING, DO_MORE, KEEP_DOING
+from api.answer_catalog import catalog
+from api.advice_pipeline import (MISSING_ANSWER_TEXT, PROFILE_FIELDS, ScoredQuestion, build_message_batches,
+                                 extract_profile, retrieve_texts, score_questions)
+from api.advice_store import (ADVICE_STORE_PATH, AdviceStore, StoredAdvice, content_hash,
+                              current_template_hash)
+from api.llm_dispatcher import RateBudget, dispatcher
+from api.llm_service import CALL_TIMEOUT, complete, completion_key
+from api.observability import configure_logging
+
+ALL_CATEGORIES = [START_DOING, DO_MORE, KEEP_DOING]
+# 每生成这么多条或间隔这么多秒写入一次，中断时最多丢失一批
+FLUSH_SIZE = 20
+FLUSH_INTERVAL = 2.0
+
+# (画像, question_id, 问题原文, 建议类型)
+Combination = Tuple[Tuple[str, ...], str, str, str]
+
+
+def combinations_from_config(config: Dict[str, Any]) -> List[Combination]:
+    if "profiles" in config:
+        profiles = [tuple(p.get(field, "") for field in PROFILE_FIELDS) for p in config["profiles"]]
+    else:
+        values = config["profile_values"]
+        profiles = list(itertools.product(*[values.get(field) or [""] for field in PROFILE_FIELDS]))
+    categories = config.get("categories") or ALL_CATEGORIES
+    return [
+        (profile, q["question_id"], q["question"], category)
+        for profile in profiles
+        for q in config["questions"]
+        for category in categories
+    ]
+
+
+def iter_stored_reports(path: str) -> Iterator[Dict[str, Any]]:
+    from api.report_store import JSONLReportBackend, SQLiteReportBackend, iter_cosmos_reports
+    if path == "cosmos":
+        return iter_cosmos_reports(os.getenv("COSMOS_ENDPOINT"), os.getenv("COSMOS_KEY"))
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    backend = JSONLReportBackend(path) if path.endswith(".jsonl") else SQLiteReportBackend(path)
+    return backend.iter_reports()
+
+
+def combinations_from_reports(path: str, min_count: int, all_categories: bool) -> List[Combination]:
+    """按组合在历史报告中出现的次数从高到低排序；all_categories 时每道题生成全部三种建议类型。"""
+    counts: Counter = Counter()
+    invalid = 0
+    for report in iter_stored_reports(path):
+        try:
+            assessment_data = AssessmentData.model_validate(report.get("assessmentData"))
+        except ValidationError:
+            invalid += 1
+            continue
+        profile = extract_profile(assessment_data.serviceOffering)
+        profile_key = tuple(profile[field] for field in PROFILE_FIELDS)
+        for q in score_questions(assessment_data):
+            categories = ALL_CATEGORIES if all_categories else [q.new_category]
+            for category in categories:
+                counts[(profile_key, q.question_id, q.entry.question, category)] += 1
+    if invalid:
+        logging.warning(f"跳过 {invalid} 份无法解析的报告")
+    return [combo for combo, count in counts.most_common() if count >= min_count]
+
+
+async def build_records(combinations: List[Combination],
+                        template_hash: str) -> List[Tuple[StoredAdvice, List[Dict[str, str]]]]:
+    """按线上请求相同的方式检索答案并渲染 prompt，返回 (待写入的记录, 消息)，advice 待填。"""
+    by_profile: Dict[Tuple[str, ...], List[Combination]] = {}
+    for combo in combinations:
+        by_profile.setdefault(combo[0], []).append(combo)
+
+    records, seen = [], set()
+    for profile_key, combos in by_profile.items():
+        profile = dict(zip(PROFILE_FIELDS, profile_key))
+        profile_hash = content_hash(*profile_key)
+        questions = [ScoredQuestion(qid, QuestionEntry(question=question), 0.0, category)
+                     for _, qid, question, category in combos]
+        base_texts = await retrieve_texts(questions)
+        system_prompt = SYSTEM_PROMPT_TEMPLATE.format(**profile)
+        for q, base_text, messages in zip(questions, base_texts,
+                                          build_message_batches(questions, base_texts, system_prompt)):
+            key = completion_key(messages)
+            if key in seen:
+                continue
+            seen.add(key)
+            record = StoredAdvice(key, q.question_id, q.new_category, profile_hash, template_hash,
+                                  content_hash(base_text), "")
+            records.append((record, messages))
+    return records
+
+
+async def generate(store: AdviceStore, pending: List[Tuple[StoredAdvice, List[Dict[str, str]]]],
+                   concurrency: int) -> Tuple[int, int]:
+    """用 concurrency 个 worker 生成建议并分批写入，返回 (成功数, 失败数)。"""
+    queue: asyncio.Queue = asyncio.Queue()
+    for item in pending:
+        queue.put_nowait(item)
+    buffer: List[StoredAdvice] = []
+    stats = {"done": 0, "failed": 0, "flushed_at": time.monotonic()}
+    flush_lock = asyncio.Lock()
+
+    async def flush():
+        async with flush_lock:
+            batch = buffer[:]
+            buffer.clear()
+            stats["flushed_at"] = time.monotonic()
+            if batch:
+                await asyncio.to_thread(store.put_many, batch)
+                logging.info(f"已写入 {stats['done']}/{len(pending)}，失败 {stats['failed']}")
+
+    async def worker():
+        while not queue.empty():
+            record, messages = queue.get_nowait()
+            try:
+                advice = await asyncio.wait_for(complete(messages), timeout=CALL_TIMEOUT)
+                if not advice or not advice.strip():
+                    raise ValueError("LLM返回空内容")
+            except Exception as e:
+                stats["failed"] += 1
+                logging.warning(f"生成失败 {record.question_id}/{record.category}: {e!r}")
+                continue
+            record.advice = advice
+            buffer.append(record)
+            stats["done"] += 1
+            if len(buffer) >= FLUSH_SIZE or time.monotonic() - stats["flushed_at"] >= FLUSH_INTERVAL:
+                await flush()
+
+    try:
+        await asyncio.gather(*[worker() for _ in range(max(1, concurrency))])
+    finally:
+        # 中断时也写入已生成的结果，下次运行从剩余部分继续
+        await flush()
+    return stats["done"], stats["failed"]
+
+
+def prune(store: AdviceStore) -> int:
+    """删除 prompt 模板/模型参数或答案目录文本已变化的记录。"""
+    pairs = store.source_pairs()
+    texts = catalog.get_answer_texts(pairs)
+    source_hashes = {pair: content_hash(MISSING_ANSWER_TEXT if text is None else text)
+                     for pair, text in zip(pairs, texts)}
+    return store.prune(current_template_hash(), source_hashes)
+
+
+async def run(args: argparse.Namespace) -> int:
+    store = AdviceStore(args.store)
+    # 与线上请求使用相同的答案目录
+    if not catalog.refresh():
+        print("答案目录加载失败，无法生成", file=sys.stderr)
+        return 2
+    if args.prune:
+        print(f"已清理失效条目 {prune(store)} 条")
+    if not args.config and not args.reports:
+        return 0
+
+    if args.config:
+        with open(args.config, encoding="utf-8") as f:
+            combinations = combinations_from_config(json.load(f))
+    else:
+        combinations = combinations_from_reports(args.reports, args.min_count, args.all_categories)
+    if args.limit:
+        combinations = combinations[:args.limit]
+
+    records = await build_records(combinations, current_template_hash())
+    existing = store.existing_keys([record.key for record, _ in records])
+    pending = [(record, messages) for record, messages in records if record.key not in existing]
+    print(f"组合 {len(records)} 个，已是最新 {len(existing)} 个，待生成 {len(pending)} 个")
+    if args.dry_run or not pending:
+        return 0
+
+    if dispatcher is None:
+        print("Azure OpenAI 客户端未初始化", file=sys.stderr)
+        return 2
+    # 离线任务可使用独立的额度，避免挤占线上流量
+    for deployment in dispatcher.deployments:
+        if args.rpm is not None:
+            deployment.rpm = RateBudget(args.rpm)
+        if args.tpm is not None:
+            deployment.tpm = RateBudget(args.tpm)
+
+    start = time.perf_counter()
+    try:
+        done, failed = await generate(store, pending, args.concurrency)
+    finally:
+        store.close()
+    print(f"生成 {done} 条，失败 {failed} 条，用时 {time.perf_counter() - start:.1f}s（失败的条目下次运行时重试）")
+    return 1 if failed else 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--config", help="枚举配置 JSON")
+    source.add_argument("--reports", help="历史报告文件（.jsonl 或 SQLite），或 cosmos")
+    parser.add_argument("--min-count", type=int, default=1, help="--reports 时只生成至少出现这么多次的组合")
+    parser.add_argument("--all-categories", action="store_true", help="--reports 时每道题生成全部三种建议类型")
+    parser.add_argument("--limit", type=int, default=0, help="最多处理的组合数（按出现次数从高到低），0 表示不限")
+    parser.add_argument("--concurrency", type=int, default=16, help="同时进行的LLM调用数")
+    parser.add_argument("--rpm", type=float, help="覆盖每个 deployment 的每分钟请求额度")
+    parser.add_argument("--tpm", type=float, help="覆盖每个 deployment 的每分钟 token 额度")
+    parser.add_argument("--store", default=ADVICE_STORE_PATH, help="预生成建议库路径")
+    parser.add_argument("--prune", action="store_true", help="先清理失效条目")
+    parser.add_argument("--dry-run", action="store_true", help="只统计待生成数量，不调用LLM")
+    args = parser.parse_args(argv)
+    if not (args.config or args.reports or args.prune):
+        parser.error("需要 --config、--reports 或 --prune")
+
+    configure_logging()
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -57,4 +57,25 @@ Based on this data, generate a single behavioral recommendation paragraph tailor
 - `"retrieved_text"`: {retrieved_text}
 
 Please provide a single actionable recommendation paragraph that addresses the user's specific business context and challenges, based on the base_text and tailored to their industry, business challenge, service type, and revenue model.
-"""
\ No newline at end of file
+"""
+
+# Batched mode: several questions share one system prompt and are answered in a single JSON response
+
+BATCH_USER_PROMPT_TEMPLATE = """
+# Input
+You will receive a JSON array of questions. Each item contains the following fields:
+- `"question_id"`: identifier of the question, copy it unchanged into your answer
+- `"original_question"`: the question text
+- `"advice_type"`: the type of advice required
+- `"retrieved_text"`: the basic text retrieved from the original dataset
+
+For every item, generate a single behavioral recommendation paragraph tailored to the user's business context, based on its retrieved_text and tailored to their industry, business challenge, service type, and revenue model. Apply all of the rules above to each recommendation independently.
+
+## Questions
+{questions_json}
+
+# Output Format
+Respond with a single JSON object and nothing else, in exactly this shape:
+{{"recommendations": [{{"question_id": "<question_id>", "advice": "<one paragraph recommendation>"}}]}}
+Return exactly one entry for every question_id in the input, in the same order.
+"""
@@ -0,0 +1,353 @@
+import os
+import glob
+import json
+import time
+import asyncio
+import uuid
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+from dotenv import load_dotenv
+from api.observability import COSMOS_REQUEST_SECONDS, record_cosmos_charge
+
+# --- 配置 ---
+load_dotenv()
+# 存储后端：cosmos / sqlite / jsonl
+REPORT_STORE_BACKEND = os.getenv("REPORT_STORE_BACKEND", "cosmos")
+# sqlite / jsonl 后端的文件路径
+REPORT_STORE_PATH = os.getenv("REPORT_STORE_PATH", "data/reports.sqlite3")
+# Cosmos 后端使用的数据库和容器（容器分区键为 /id）
+REPORT_DATABASE_NAME = os.getenv("REPORT_DATABASE_NAME", "PromptEngineeringDB")
+REPORT_CONTAINER_NAME = os.getenv("REPORT_CONTAINER_NAME", "reports")
+# 写入队列容量，队列满时新请求最多等待 REPORT_ENQUEUE_TIMEOUT 秒，之后返回 503
+REPORT_QUEUE_SIZE = int(os.getenv("REPORT_QUEUE_SIZE", "1000"))
+REPORT_ENQUEUE_TIMEOUT = float(os.getenv("REPORT_ENQUEUE_TIMEOUT", "2"))
+# 攒够 REPORT_BATCH_SIZE 条或等待 REPORT_FLUSH_INTERVAL 秒后写入一次
+REPORT_BATCH_SIZE = int(os.getenv("REPORT_BATCH_SIZE", "50"))
+REPORT_FLUSH_INTERVAL = float(os.getenv("REPORT_FLUSH_INTERVAL", "1"))
+# 单批写入失败后的重试次数
+REPORT_WRITE_RETRIES = 3
+# 重试后仍写入失败的报告转存到该 JSONL 文件，服务下次启动时重新写入后端
+REPORT_SPILL_PATH = os.getenv("REPORT_SPILL_PATH", "data/reports_spill.jsonl")
+
+
+class ReportQueueFull(Exception):
+    """写入队列已满（后端写入跟不上），调用方应稍后重试。"""
+
+
+def report_key(idempotency_key: Optional[str] = None) -> str:
+    """
+    报告 id：使用客户端提供的 Idempotency-Key，否则每次保存生成新的 id。
+
+    报告中没有用户身份，不同用户的答案可能完全相同，因此不能按内容去重。
+    """
+    if idempotency_key:
+        return idempotency_key
+    return uuid.uuid4().hex
+
+
+class SQLiteReportBackend:
+    """本地 SQLite 存储，按 id 覆盖写入，适合测试和单机部署。"""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS reports (id TEXT PRIMARY KEY, received_at TEXT NOT NULL, payload TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+    def _write(self, records: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO reports (id, received_at, payload) VALUES (?, ?, ?)",
+                [(r["id"], r["receivedAt"], json.dumps(r, ensure_ascii=False)) for r in records]
+            )
+            self._conn.commit()
+
+    async def write_batch(self, records: List[Dict[str, Any]]) -> None:
+        await asyncio.to_thread(self._write, records)
+
+    def iter_reports(self) -> Iterator[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT payload FROM reports ORDER BY received_at").fetchall()
+        for (payload,) in rows:
+            yield json.loads(payload)
+
+    async def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class JSONLReportBackend:
+    """本地 JSONL 文件存储，每行一条报告；启动时读取已有 id，重复 id 不再追加。"""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._path = path
+        self._lock = threading.Lock()
+        self._ids = {r["id"] for r in self.iter_reports()}
+
+    def _write(self, records: List[Dict[str, Any]]) -> None:
+        with self._lock, open(self._path, "a", encoding="utf-8") as f:
+            for r in records:
+                if r["id"] in self._ids:
+                    continue
+                f.write(json.dumps(r, ensure_ascii=False) + "\n")
+                self._ids.add(r["id"])
+
+    async def write_batch(self, records: List[Dict[str, Any]]) -> None:
+        await asyncio.to_thread(self._write, records)
+
+    def iter_reports(self) -> Iterator[Dict[str, Any]]:
+        if not os.path.exists(self._path):
+            return
+        with open(self._path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    async def close(self) -> None:
+        pass
+
+
+class CosmosReportBackend:
+    """Cosmos DB 存储，使用异步 SDK 并发 upsert 一批报告；id 即幂等键，重复提交会覆盖同一条记录。"""
+
+    def __init__(self, endpoint: str, key: str, database_name: str = REPORT_DATABASE_NAME,
+                 container_name: str = REPORT_CONTAINER_NAME):
+        from azure.cosmos.aio import CosmosClient
+        self._client = CosmosClient(url=endpoint, credential=key)
+        self._container = self._client.get_database_client(database_name).get_container_client(container_name)
+
+    async def _upsert(self, record: Dict[str, Any]) -> None:
+        start = time.perf_counter()
+        try:
+            # 并发 upsert 时 last_response_headers 会被其它请求覆盖，用 response_hook 取本次请求的 RU
+            await self._container.upsert_item(
+                record, response_hook=lambda headers, _: record_cosmos_charge("save_report", headers)
+            )
+        finally:
+            COSMOS_REQUEST_SECONDS.labels("save_report").observe(time.perf_counter() - start)
+
+    async def write_batch(self, records: List[Dict[str, Any]]) -> None:
+        results = await asyncio.gather(*[self._upsert(r) for r in records], return_exceptions=True)
+        errors = [r for r in results if isinstance(r, Exception)]
+        if errors:
+            raise errors[0]
+
+    async def close(self) -> None:
+        await self._client.close()
+
+
+def iter_cosmos_reports(endpoint: str, key: str, database_name: str = REPORT_DATABASE_NAME,
+                        container_name: str = REPORT_CONTAINER_NAME) -> Iterator[Dict[str, Any]]:
+    """用同步 SDK 分页读取 Cosmos 容器中保存的全部报告，供离线任务使用。"""
+    from azure.cosmos import CosmosClient
+    client = CosmosClient(url=endpoint, credential=key)
+    container = client.get_database_client(database_name).get_container_client(container_name)
+    yield from container.query_items(
+        "SELECT c.id, c.receivedAt, c.assessmentData FROM c", enable_cross_partition_query=True
+    )
+
+
+class ReportWriter:
+    """
+    报告的后写（write-behind）持久化。
+
+    请求只负责入队，后台任务攒批后写入后端：满 batch_size 条或距上次写入超过 flush_interval 秒即写一次。
+    队列有界，后端写入跟不上时入队会等待，超时则抛出 ReportQueueFull。
+    重试后仍写入失败的批次转存到本地 JSONL 文件（spill_path），下次启动时重新写入后端。
+    """
+
+    def __init__(self, backend, queue_size: int = REPORT_QUEUE_SIZE, batch_size: int = REPORT_BATCH_SIZE,
+                 flush_interval: float = REPORT_FLUSH_INTERVAL, enqueue_timeout: float = REPORT_ENQUEUE_TIMEOUT,
+                 spill_path: str = REPORT_SPILL_PATH):
+        self.backend = backend
+        self._spill_path = spill_path
+        self._spill_lock = threading.Lock()
+        self._replay: Optional[asyncio.Task] = None
+        self._queue_size = queue_size
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._enqueue_timeout = enqueue_timeout
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # 最近入队的幂等键，用于在写入前就丢弃客户端重试产生的重复报告
+        self._recent_keys: "OrderedDict[str, None]" = OrderedDict()
+
+    def start(self) -> None:
+        self._queue = asyncio.Queue(maxsize=self._queue_size)
+        self._task = asyncio.create_task(self._run())
+        self._replay = asyncio.create_task(self._replay_spilled())
+
+    async def enqueue(self, report: Dict[str, Any], idempotency_key: Optional[str] = None) -> str:
+        """
+        将报告放入写入队列并立即返回，不等待数据库写入。
+
+        Args:
+            report (Dict[str, Any]): 报告内容（AssessmentData）。
+            idempotency_key (Optional[str]): 客户端提供的幂等键。
+
+        Returns:
+            str: 报告 id（提供幂等键时即为该键）。
+
+        Raises:
+            ReportQueueFull: 队列在 REPORT_ENQUEUE_TIMEOUT 秒内一直是满的。
+        """
+        if self._queue is None:
+            raise RuntimeError("ReportWriter 尚未启动")
+        report_id = report_key(idempotency_key)
+        if report_id in self._recent_keys:
+            return report_id
+        record = {"id": report_id, "receivedAt": datetime.utcnow().isoformat(), "assessmentData": report}
+        try:
+            await asyncio.wait_for(self._queue.put(record), timeout=self._enqueue_timeout)
+        except asyncio.TimeoutError:
+            raise ReportQueueFull(f"报告写入队列已满（{self._queue_size}）")
+        self._recent_keys[report_id] = None
+        while len(self._recent_keys) > self._queue_size * 10:
+            self._recent_keys.popitem(last=False)
+        return report_id
+
+    async def _next_batch(self) -> List[Dict[str, Any]]:
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self._flush_interval
+        while len(batch) < self._batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _write(self, batch: List[Dict[str, Any]]) -> None:
+        for attempt in range(1, REPORT_WRITE_RETRIES + 1):
+            try:
+                await self.backend.write_batch(batch)
+                logging.info(f"已写入 {len(batch)} 份报告")
+                return
+            except Exception as e:
+                logging.error(f"写入报告失败（第 {attempt} 次）: {e}")
+                if attempt < REPORT_WRITE_RETRIES:
+                    await asyncio.sleep(0.5 * 2 ** attempt)
+        # 客户端使用相同幂等键重试时应重新入队，而不是被当作已保存
+        for r in batch:
+            self._recent_keys.pop(r["id"], None)
+        try:
+            await asyncio.to_thread(self._spill, batch)
+            logging.error(f"{len(batch)} 份报告写入失败，已转存到 {self._spill_path}")
+        except Exception as e:
+            logging.error(f"转存报告失败，放弃写入 {len(batch)} 份报告: {[r['id'] for r in batch]}: {e}")
+
+    def _spill(self, batch: List[Dict[str, Any]]) -> None:
+        directory = os.path.dirname(self._spill_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._spill_lock, open(self._spill_path, "a", encoding="utf-8") as f:
+            for r in batch:
+                f.write(json.dumps(r, ensure_ascii=False) + "\n")
+
+    def _claim_spilled(self) -> List[str]:
+        """
+        先改名再读取，多个 worker 进程同时启动时每个文件只有一个进程能取到。
+
+        除新转存的文件外，也取回之前的进程重放中途退出后遗留的 <spill_path>.* 文件。
+        """
+        claimed = []
+        for path in [self._spill_path] + sorted(glob.glob(glob.escape(self._spill_path) + ".*")):
+            target = f"{self._spill_path}.{os.getpid()}.{uuid.uuid4().hex[:8]}"
+            try:
+                os.replace(path, target)
+            except FileNotFoundError:
+                continue
+            claimed.append(target)
+        return claimed
+
+    @staticmethod
+    def _read_spilled(path: str) -> List[Dict[str, Any]]:
+        records = []
+        with open(path, encoding="utf-8") as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError as e:
+                    logging.error(f"跳过无法解析的转存报告 {path}:{line_no}: {e}")
+        return records
+
+    async def _replay_spilled(self) -> None:
+        """将之前转存的报告重新写入后端；仍然失败的会再次转存。出错时只记录日志，文件留待下次启动重放。"""
+        try:
+            claimed = await asyncio.to_thread(self._claim_spilled)
+            for path in claimed:
+                records = await asyncio.to_thread(self._read_spilled, path)
+                logging.info(f"重新写入 {len(records)} 份之前转存的报告")
+                for i in range(0, len(records), self._batch_size):
+                    await self._write(records[i:i + self._batch_size])
+                os.remove(path)
+        except Exception as e:
+            logging.error(f"重新写入转存的报告失败: {e}")
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def stop(self) -> None:
+        """停止后台任务前写完队列中剩余的报告，并关闭后端。"""
+        if self._task is None:
+            return
+        try:
+            # 先等重放结束，避免关闭后端时仍在写入
+            await self._replay
+        finally:
+            try:
+                await self._queue.join()
+            finally:
+                self._task.cancel()
+                try:
+                    await self._task
+                except asyncio.CancelledError:
+                    pass
+                self._task = None
+                await self.backend.close()
+
+
+def create_backend():
+    if REPORT_STORE_BACKEND == "sqlite":
+        return SQLiteReportBackend(REPORT_STORE_PATH)
+    if REPORT_STORE_BACKEND == "jsonl":
+        return JSONLReportBackend(REPORT_STORE_PATH)
+    if REPORT_STORE_BACKEND == "cosmos":
+        return CosmosReportBackend(os.getenv("COSMOS_ENDPOINT"), os.getenv("COSMOS_KEY"))
+    raise ValueError(f"未知的 REPORT_STORE_BACKEND: {REPORT_STORE_BACKEND}")
+
+
+def create_writer() -> Optional[ReportWriter]:
+    try:
+        return ReportWriter(create_backend())
+    except Exception as e:
+        logging.error(f"Failed to initialize report store: {e}")
+        return None
+
+
+# --- 全局写入器 ---
+# 在应用启动（lifespan）时调用 report_writer.start()，关闭时调用 await report_writer.stop() 写完剩余报告。
+report_writer = create_writer()
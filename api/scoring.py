@@ -0,0 +1,202 @@
+import os
+import csv
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from api.models import AssessmentData, QuestionEntry, ServiceOfferingAnswer
+
+SCORE_RULE_PATH = os.path.join(os.path.dirname(__file__), "score_rule.csv")
+
+WEIGHT_PER_RULE = 0.25  # 每个满足的规则加权25%
+START_DOING = 'Start_Doing'
+DO_MORE = 'Do_More'
+KEEP_DOING = 'Keep_Doing'
+
+ScoreResult = Tuple[float, str]  # (new_score, new_category)
+
+
+# 读取 score_rule.csv，返回 {question_id: [规则1, 规则2, ...]}
+def load_score_rules(csv_path):
+    rules = {}
+    with open(csv_path, newline='', encoding='utf-8-sig') as csvfile:
+        reader = csv.reader(csvfile)
+        headers = next(reader)
+        for row in reader:
+            qid = row[0]
+            rules[qid] = row[1:]
+    return rules
+
+
+# 解析 "R2 - A or B" 形式的规则，返回 ('R2', ['a', 'b'])；无效规则返回 None
+def parse_rule(rule: str) -> Optional[Tuple[str, List[str]]]:
+    if not rule or '-' not in rule:
+        return None
+    r_name, r_opts = rule.split('-')
+    r_name = r_name.strip()
+    r_opts = [opt.strip().lower() for opt in r_opts.strip().replace(' ', '').split('or')]
+    return r_name, r_opts
+
+
+# 判断是否满足加权规则（逐条规则的参考实现，结果与 CompiledRules 一致）
+def check_weighting(rules, service_offering):
+    satisfied_count = 0
+
+    for rule in rules:
+        parsed = parse_rule(rule)
+        if parsed is None:
+            continue
+        r_name, r_opts = parsed
+
+        for so in service_offering.values():
+            if so.get('question_name') == r_name:
+                user_ans = so.get('anwserselete', '').lower()
+                if user_ans in r_opts:
+                    satisfied_count += 1
+                break
+
+    return satisfied_count
+
+
+def question_id_for(idx: int) -> str:
+    return f"question_{idx:02d}"
+
+
+@dataclass(frozen=True)
+class CompiledRules:
+    """
+    编译后的加权规则。
+
+    规则名（R1、R2…）映射为列下标，选项（a/b/c…）映射为比特位，
+    每个问题的规则存为 (问题数+1, 每题规则数) 的下标矩阵和选项掩码矩阵。
+    最后一行/最后一列为哨兵：未配置规则的问题和不存在的答案都指向它，掩码恒为0。
+    """
+    question_index: Dict[str, int]
+    rule_index: Dict[str, int]
+    option_bits: Dict[str, int]
+    rule_columns: np.ndarray  # (Q+1, K) int64
+    rule_masks: np.ndarray    # (Q+1, K) int64
+
+    @classmethod
+    def from_rules(cls, rules: Dict[str, List[str]]) -> "CompiledRules":
+        question_index = {}
+        rule_index = {}
+        option_bits = {}
+        parsed_rows = []
+        for qid, row in rules.items():
+            parsed = [p for p in (parse_rule(rule) for rule in row) if p is not None]
+            question_index[qid] = len(parsed_rows)
+            parsed_rows.append(parsed)
+            for r_name, r_opts in parsed:
+                rule_index.setdefault(r_name, len(rule_index))
+                for opt in r_opts:
+                    option_bits.setdefault(opt, 1 << len(option_bits))
+        if len(option_bits) > 62:
+            raise ValueError(f"选项种类过多（{len(option_bits)}），无法编码为 int64 掩码")
+
+        sentinel_column = len(rule_index)
+        width = max((len(parsed) for parsed in parsed_rows), default=0)
+        rule_columns = np.full((len(parsed_rows) + 1, width), sentinel_column, dtype=np.int64)
+        rule_masks = np.zeros((len(parsed_rows) + 1, width), dtype=np.int64)
+        for row_idx, parsed in enumerate(parsed_rows):
+            for k, (r_name, r_opts) in enumerate(parsed):
+                rule_columns[row_idx, k] = rule_index[r_name]
+                mask = 0
+                for opt in r_opts:
+                    mask |= option_bits[opt]
+                rule_masks[row_idx, k] = mask
+        return cls(question_index, rule_index, option_bits, rule_columns, rule_masks)
+
+    def encode_answers(self, service_offering: Dict[str, ServiceOfferingAnswer]) -> np.ndarray:
+        """把 serviceOffering 编码为 (规则数+1,) 的选项比特向量；同名规则只取第一个回答。"""
+        codes = np.zeros(len(self.rule_index) + 1, dtype=np.int64)
+        seen = set()
+        for so in service_offering.values():
+            column = self.rule_index.get(so.question_name)
+            if column is None or column in seen:
+                continue
+            seen.add(column)
+            codes[column] = self.option_bits.get((so.anwserselete or '').lower(), 0)
+        return codes
+
+    def question_rows(self, n_questions: int) -> np.ndarray:
+        sentinel_row = len(self.question_index)
+        return np.array([self.question_index.get(question_id_for(i), sentinel_row) for i in range(n_questions)],
+                        dtype=np.int64)
+
+    def score_batch(self, assessments: Sequence[Tuple[Dict[str, ServiceOfferingAnswer], Sequence[float]]]
+                    ) -> List[List[ScoreResult]]:
+        """
+        一次性计算多份评估的加权分数和新分类。
+
+        Args:
+            assessments: [(serviceOffering, [原始分数按问题顺序]), ...]
+
+        Returns:
+            List[List[Tuple[new_score, new_category]]]: 与输入一一对应。
+        """
+        if not assessments:
+            return []
+        n_max = max(len(scores) for _, scores in assessments)
+        answers = np.stack([self.encode_answers(so) for so, _ in assessments])  # (B, R+1)
+        scores = np.zeros((len(assessments), n_max), dtype=np.float64)
+        for b, (_, raw_scores) in enumerate(assessments):
+            scores[b, :len(raw_scores)] = raw_scores
+
+        rows = self.question_rows(n_max)
+        columns = self.rule_columns[rows]  # (N, K)
+        masks = self.rule_masks[rows]      # (N, K)
+        satisfied = ((answers[:, columns] & masks) != 0).sum(axis=-1)  # (B, N)
+
+        weighted = np.where(satisfied > 0, scores * (1 + satisfied * WEIGHT_PER_RULE), scores)
+        categories = np.select([weighted < -1, weighted > 1], [START_DOING, KEEP_DOING], DO_MORE)
+
+        results = []
+        for b, (_, raw_scores) in enumerate(assessments):
+            scored = []
+            for i in range(len(raw_scores)):
+                scored.append((weighted[b, i].item(), str(categories[b, i])))
+            results.append(scored)
+        return results
+
+    def score(self, service_offering: Dict[str, ServiceOfferingAnswer], scores: Sequence[float]) -> List[ScoreResult]:
+        return self.score_batch([(service_offering, scores)])[0]
+
+
+class ScoringEngine:
+    """持有编译后的规则，score_rule.csv 修改时间变化后自动重新编译。"""
+
+    def __init__(self, csv_path: str = SCORE_RULE_PATH):
+        self._csv_path = csv_path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._compiled: Optional[CompiledRules] = None
+        self.rules()
+
+    def rules(self) -> CompiledRules:
+        mtime = os.stat(self._csv_path).st_mtime_ns
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    self._compiled = CompiledRules.from_rules(load_score_rules(self._csv_path))
+                    self._mtime = mtime
+                    logging.info(f"已编译加权规则: {self._csv_path}")
+        return self._compiled
+
+    def score_questions(self, service_offering: Dict[str, ServiceOfferingAnswer],
+                        questions: Sequence[QuestionEntry]) -> List[ScoreResult]:
+        return self.rules().score(service_offering, [q.score for q in questions])
+
+    def score_reports(self, assessment_datas: Sequence[Dict[str, Any]]) -> List[List[ScoreResult]]:
+        """批量重新计算多份已保存报告（assessmentData 结构）的加权分数和新分类，供后台重算任务使用。"""
+        batch = []
+        for raw in assessment_datas:
+            assessment_data = AssessmentData.model_validate(raw)
+            batch.append((assessment_data.serviceOffering, [q.score for q in assessment_data.questions()]))
+        return self.rules().score_batch(batch)
+
+
+# --- 全局引擎实例 ---
+# 模块导入（应用启动）时编译一次规则。
+engine = ScoringEngine()
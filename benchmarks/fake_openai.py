@@ -0,0 +1,144 @@
+"""
+本地 Azure OpenAI chat completions 替身服务，用于离线压测。
+
+可配置响应延迟分布（对数正态）、错误率和 429 限流注入（按比例随机注入，或按每个 deployment 的 RPM 额度限流）：
+
+    python -m benchmarks.fake_openai --port 9100 --latency-median 0.8 --throttle-rate 0.05
+    python -m benchmarks.fake_openai --port 9100 --rpm-limit 600 --throttle-deployments east
+"""
+import json
+import math
+import time
+import random
+import asyncio
+import argparse
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from typing import Optional, Tuple
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+@dataclass
+class StubConfig:
+    latency_median: float = 0.5   # 响应延迟中位数（秒）
+    latency_sigma: float = 0.4    # 对数正态分布的 sigma，越大长尾越明显
+    error_rate: float = 0.0       # 返回 500 的比例
+    throttle_rate: float = 0.0    # 返回 429 的比例
+    retry_after: float = 1.0      # 429 响应的 Retry-After（秒）
+    seed: int = 0
+    rpm_limit: int = 0            # 每个 deployment 的每分钟请求额度（与 Azure 一样按 10 秒窗口 rpm/6 执行），0 表示不限制
+    throttle_deployments: Tuple[str, ...] = ()  # 只对这些 deployment 注入 429，空表示全部
+
+
+def _questions_from_batch_prompt(prompt: str):
+    try:
+        return json.loads(prompt.split("## Questions\n", 1)[1].split("\n\n# Output Format", 1)[0])
+    except (IndexError, ValueError):
+        return []
+
+
+def create_app(config: StubConfig) -> FastAPI:
+    app = FastAPI()
+    rng = random.Random(config.seed)
+    stats = {"calls": 0, "ok": 0, "errors": 0, "throttled": 0, "prompt_tokens": 0, "completion_tokens": 0,
+             "by_deployment": defaultdict(lambda: defaultdict(int))}
+    accepted = defaultdict(deque)  # deployment -> 最近10秒内受理请求的时间
+
+    def throttle_wait(deployment: str, roll: float) -> Optional[float]:
+        """需要返回 429 时给出 Retry-After 秒数，否则返回 None。"""
+        if config.throttle_deployments and deployment not in config.throttle_deployments:
+            return None
+        if roll < config.throttle_rate:
+            return config.retry_after
+        if config.rpm_limit > 0:
+            now, window = time.monotonic(), accepted[deployment]
+            while window and now - window[0] >= 10:
+                window.popleft()
+            if len(window) >= max(1, config.rpm_limit // 6):
+                return 10 - (now - window[0])
+            window.append(now)
+        return None
+
+    @app.post("/openai/deployments/{deployment}/chat/completions")
+    async def chat_completions(deployment: str, request: Request):
+        body = await request.json()
+        stats["calls"] += 1
+        stats["by_deployment"][deployment]["calls"] += 1
+        roll = rng.random()
+        retry_after = throttle_wait(deployment, roll)
+        if retry_after is not None:
+            stats["throttled"] += 1
+            stats["by_deployment"][deployment]["throttled"] += 1
+            return JSONResponse(
+                status_code=429,
+                headers={"Retry-After": str(math.ceil(retry_after)), "retry-after-ms": str(int(retry_after * 1000))},
+                content={"error": {"code": "429", "message": "Rate limit is exceeded (stub)."}}
+            )
+        await asyncio.sleep(rng.lognormvariate(0, config.latency_sigma) * config.latency_median)
+        if config.throttle_rate <= roll < config.throttle_rate + config.error_rate:
+            stats["errors"] += 1
+            return JSONResponse(status_code=500, content={"error": {"code": "500", "message": "Injected failure (stub)."}})
+
+        messages = body.get("messages", [])
+        prompt = messages[-1]["content"] if messages else ""
+        if (body.get("response_format") or {}).get("type") == "json_object":
+            content = json.dumps({"recommendations": [
+                {"question_id": q.get("question_id"), "advice": f"Stub advice for {q.get('original_question', '')}"}
+                for q in _questions_from_batch_prompt(prompt)
+            ]})
+        else:
+            content = "Stub advice: " + " ".join(prompt.split()[-40:])
+        prompt_tokens = sum(len(m.get("content", "")) for m in messages) // 4
+        completion_tokens = len(content) // 4
+        stats["ok"] += 1
+        stats["by_deployment"][deployment]["ok"] += 1
+        stats["prompt_tokens"] += prompt_tokens
+        stats["completion_tokens"] += completion_tokens
+        return {
+            "id": f"chatcmpl-stub-{stats['calls']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": deployment,
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    @app.post("/stats/reset")
+    async def reset_stats():
+        for key in stats:
+            stats[key] = 0
+        stats["by_deployment"] = defaultdict(lambda: defaultdict(int))
+        return stats
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-median", type=float, default=StubConfig.latency_median)
+    parser.add_argument("--latency-sigma", type=float, default=StubConfig.latency_sigma)
+    parser.add_argument("--error-rate", type=float, default=StubConfig.error_rate)
+    parser.add_argument("--throttle-rate", type=float, default=StubConfig.throttle_rate)
+    parser.add_argument("--retry-after", type=float, default=StubConfig.retry_after)
+    parser.add_argument("--seed", type=int, default=StubConfig.seed)
+    parser.add_argument("--rpm-limit", type=int, default=StubConfig.rpm_limit)
+    parser.add_argument("--throttle-deployments", default="", help="逗号分隔，只对这些 deployment 注入 429")
+    args = parser.parse_args()
+
+    import uvicorn
+    throttle_deployments = tuple(name.strip() for name in args.throttle_deployments.split(",") if name.strip())
+    config = StubConfig(args.latency_median, args.latency_sigma, args.error_rate, args.throttle_rate,
+                        args.retry_after, args.seed, args.rpm_limit, throttle_deployments)
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
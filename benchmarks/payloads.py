@@ -0,0 +1,57 @@
+import random
+from typing import Any, Dict
+
+# 与 README 示例一致的分组结构
+SECTIONS = [
+    "Base camp for success (go to market GTM)",
+    "Tracking the climb (Performance Metrics PM)",
+    "Scaling essentials (Commercial Essentials CE)",
+    "Streamlining the climb (Optimal Processes OP)",
+    "Assembling the team (People, Structure & Culture PSC)",
+    "Toolbox for success (Systems & Tools ST)",
+]
+QUESTIONS_PER_SECTION = [6, 6, 6, 5, 5, 5]  # 共 33 题，对应 score_rule.csv 中的 question_00 ~ question_32
+PHASES = ["Profitable", "Repeatable", "Scalable"]
+CATEGORIES = ["Sales", "Marketing", "Customer Success", "Operations", "Finance"]
+SCORES = [-2, -1.5, -1, -0.5, 0, 0.5, 1, 1.5, 2]
+
+INDUSTRIES = ["SaaS", "Manufacturing", "Professional Services", "Healthcare", "Logistics"]
+CHALLENGES = ["Customer churn", "Long sales cycles", "Low lead conversion", "Scaling the sales team"]
+SERVICE_TYPES = ["Consulting", "Managed services", "Software subscription", "Implementation"]
+REVENUE_TYPES = ["Recurring", "Project-based", "Usage-based", "Mixed"]
+RULE_NAMES = [f"R{i}" for i in range(1, 17)]
+
+
+def make_assessment(rng: random.Random) -> Dict[str, Any]:
+    """生成一份结构与前端提交一致的 assessmentData。"""
+    service_offering = {
+        "industry": {"text": rng.choice(INDUSTRIES)},
+        "business_challenge": {"text": rng.choice(CHALLENGES)},
+        "service_type": {"text": rng.choice(SERVICE_TYPES)},
+        "revenue_type": {"text": rng.choice(REVENUE_TYPES)},
+    }
+    for idx, rule_name in enumerate(RULE_NAMES):
+        service_offering[f"so_{idx + 1:02d}"] = {
+            "question_name": rule_name,
+            "anwserselete": rng.choice("ABC"),
+            "text": f"Service offering question {rule_name}",
+        }
+
+    assessment_data = {"serviceOffering": service_offering}
+    number = 0
+    for section, count in zip(SECTIONS, QUESTIONS_PER_SECTION):
+        questions = {}
+        for _ in range(count):
+            questions[f"q{number + 1}"] = {
+                "question": f"How does your team handle area #{number + 1} of {section.split(' (')[0].lower()}?",
+                "score": rng.choice(SCORES),
+                "category": rng.choice(CATEGORIES),
+                "catmapping": rng.choice(PHASES),
+            }
+            number += 1
+        assessment_data[section] = questions
+    return assessment_data
+
+
+def make_request(rng: random.Random, user_id: str) -> Dict[str, Any]:
+    return {"userId": user_id, "assessmentData": make_assessment(rng)}
@@ -0,0 +1,299 @@
+"""
+/api/llm-advice 离线压测：启动本地 Azure OpenAI 替身和 main:app，用真实结构的评估数据按指定并发压测，
+输出 p50/p95/p99 延迟、吞吐、每请求LLM调用次数和事件循环延迟（JSON），并可与基线结果对比。
+
+    python -m benchmarks.run_benchmark --requests 200 --concurrency 20
+    python -m benchmarks.run_benchmark --baseline benchmarks/baseline.json   # 出现退化时退出码为 1
+    python -m benchmarks.run_benchmark --env LLM_BATCH_SIZE=6                # 传入额外的应用环境变量
+    python -m benchmarks.run_benchmark --env AZURE_OPENAI_DEPLOYMENTS=east,west --rpm-limit 600 --throttle-deployments east
+    python -m benchmarks.run_benchmark --pregenerate                         # 先用压测数据预生成建议库
+"""
+import os
+import sys
+import json
+import time
+import socket
+import random
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+import httpx
+from benchmarks.payloads import make_request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURE_ANSWERS = os.path.join(ROOT, "benchmarks", "fixtures", "answers.json")
+DEFAULT_OUTPUT = os.path.join(ROOT, "benchmarks", "results", "latest.json")
+
+# 与基线对比的指标：(路径, 越大越好?, 绝对容差)，绝对容差用于忽略很小数值上的抖动
+COMPARED_METRICS = [
+    (("latency_ms", "p50"), False, 5.0),
+    (("latency_ms", "p95"), False, 5.0),
+    (("latency_ms", "p99"), False, 5.0),
+    (("requests_per_second",), True, 0.0),
+    (("llm_calls_per_request",), False, 0.0),
+    (("llm_fallbacks_per_request",), False, 0.01),
+    (("loop_lag_ms", "p99_ms"), False, 5.0),
+]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_ready(url: str, process: subprocess.Popen, timeout: float = 30) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"进程提前退出（{process.returncode}）: {' '.join(process.args)}")
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"等待 {url} 就绪超时")
+
+
+@contextmanager
+def _serve(args: List[str], env: Dict[str, str], ready_url: str, verbose: bool):
+    output = None if verbose else subprocess.DEVNULL
+    process = subprocess.Popen([sys.executable, "-m", *args], cwd=ROOT, env=env, stdout=output, stderr=output)
+    try:
+        _wait_ready(ready_url, process)
+        yield process
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+# 从应用 /metrics 读取的计数器（压测前后取差值）
+SCRAPED_COUNTERS = ("llm_fallbacks_total", "llm_retries_total", "llm_throttled_total", "llm_hedges_total")
+
+
+def scrape_counters(app_url: str) -> Dict[str, float]:
+    """汇总各计数器所有标签下的数值。"""
+    totals = {name: 0.0 for name in SCRAPED_COUNTERS}
+    for line in httpx.get(f"{app_url}/metrics").text.splitlines():
+        name = line.split("{", 1)[0].split(" ", 1)[0]
+        if name in totals:
+            totals[name] += float(line.rsplit(" ", 1)[1])
+    return totals
+
+
+def pregenerate(args: argparse.Namespace, env: Dict[str, str], workdir: str) -> None:
+    """把压测请求写成历史报告，用 api.pregenerate_advice 预生成建议库（测量全部命中的路径）。"""
+    reports_path = os.path.join(workdir, "pregenerate_reports.jsonl")
+    with open(reports_path, "w", encoding="utf-8") as f:
+        for i in range(args.requests):
+            payload = make_request(random.Random(args.seed + i), f"bench_user_{args.seed + i}")
+            f.write(json.dumps({"id": str(i), "assessmentData": payload["assessmentData"]}) + "\n")
+    output = None if args.verbose else subprocess.DEVNULL
+    subprocess.run([sys.executable, "-m", "api.pregenerate_advice", "--reports", reports_path, "--concurrency", "32"],
+                   cwd=ROOT, env=env, stdout=output, stderr=output, check=True)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def drive(base_url: str, endpoint: str, n_requests: int, concurrency: int, seed: int,
+                timeout: float) -> Dict[str, Any]:
+    payloads = [make_request(random.Random(seed + i), f"bench_user_{seed + i}") for i in range(n_requests)]
+    latencies, errors = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout,
+                                 limits=httpx.Limits(max_connections=concurrency)) as client:
+        async def one(payload):
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    response = await client.post(endpoint, json=payload)
+                    ok = response.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                elapsed = time.perf_counter() - start
+            if ok:
+                latencies.append(elapsed * 1000)
+            else:
+                errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*[one(p) for p in payloads])
+        wall = time.perf_counter() - start
+
+    return {
+        "requests": n_requests,
+        "errors": errors,
+        "duration_s": wall,
+        "requests_per_second": (n_requests - errors) / wall if wall else 0.0,
+        "latency_ms": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "mean": sum(latencies) / len(latencies) if latencies else 0.0,
+            "max": max(latencies, default=0.0),
+        },
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """返回超出容差的退化项说明。"""
+    regressions = []
+    for path, higher_is_better, slack in COMPARED_METRICS:
+        cur, base = current, baseline
+        try:
+            for key in path:
+                cur, base = cur[key], base[key]
+        except (KeyError, TypeError):
+            continue
+        name = ".".join(path)
+        if higher_is_better:
+            limit = base * (1 - tolerance) - slack
+            if cur < limit:
+                regressions.append(f"{name}: {cur:.2f} < {limit:.2f} (baseline {base:.2f})")
+        else:
+            limit = base * (1 + tolerance) + slack
+            if cur > limit:
+                regressions.append(f"{name}: {cur:.2f} > {limit:.2f} (baseline {base:.2f})")
+    return regressions
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    stub_port, app_port = _free_port(), _free_port()
+    stub_url, app_url = f"http://127.0.0.1:{stub_port}", f"http://127.0.0.1:{app_port}"
+    workdir = tempfile.mkdtemp(prefix="llm-advice-bench-")
+
+    stub_env = dict(os.environ)
+    app_env = dict(os.environ)
+    app_env.update({
+        "AZURE_OPENAI_API_KEY": "bench",
+        "AZURE_OPENAI_ENDPOINT": stub_url,
+        "AZURE_OPENAI_DEPLOYMENT": "bench",
+        "ANSWER_CATALOG_PATH": args.answers,
+        "ANSWER_CATALOG_TTL": "0",
+        "LLM_CACHE_ENABLED": "1" if args.cache else "0",
+        "LLM_CACHE_PATH": os.path.join(workdir, "llm_cache.sqlite3"),
+        "ADVICE_STORE_PATH": os.path.join(workdir, "advice_store.sqlite3"),
+        "REPORT_STORE_BACKEND": "jsonl",
+        "REPORT_STORE_PATH": os.path.join(workdir, "reports.jsonl"),
+        "JOB_STORE_BACKEND": "memory",
+    })
+    for item in args.env:
+        key, _, value = item.partition("=")
+        app_env[key] = value
+
+    stub_args = ["benchmarks.fake_openai", "--port", str(stub_port),
+                 "--latency-median", str(args.latency_median), "--latency-sigma", str(args.latency_sigma),
+                 "--error-rate", str(args.error_rate), "--throttle-rate", str(args.throttle_rate),
+                 "--retry-after", str(args.retry_after), "--seed", str(args.seed),
+                 "--rpm-limit", str(args.rpm_limit), "--throttle-deployments", args.throttle_deployments]
+    app_args = ["benchmarks.serve_app", "--port", str(app_port)]
+
+    with _serve(stub_args, stub_env, f"{stub_url}/stats", args.verbose):
+        if args.pregenerate:
+            pregenerate(args, app_env, workdir)
+        with _serve(app_args, app_env, f"{app_url}/openapi.json", args.verbose):
+            if args.warmup:
+                asyncio.run(drive(app_url, args.endpoint, args.warmup, min(args.concurrency, args.warmup),
+                                  args.seed + 10_000, args.timeout))
+            httpx.post(f"{stub_url}/stats/reset")
+            httpx.get(f"{app_url}/__bench/loop-lag", params={"reset": True})
+            counters_before = scrape_counters(app_url)
+
+            results = asyncio.run(drive(app_url, args.endpoint, args.requests, args.concurrency, args.seed,
+                                        args.timeout))
+
+            stub_stats = httpx.get(f"{stub_url}/stats").json()
+            results["loop_lag_ms"] = httpx.get(f"{app_url}/__bench/loop-lag").json()
+            counters_after = scrape_counters(app_url)
+
+    completed = max(1, args.requests - results["errors"])
+    results["llm_calls_per_request"] = stub_stats["calls"] / completed
+    results["llm_tokens_per_request"] = (stub_stats["prompt_tokens"] + stub_stats["completion_tokens"]) / completed
+    results["llm_stub"] = stub_stats
+    results["app_counters"] = {name: counters_after[name] - counters_before[name] for name in SCRAPED_COUNTERS}
+    results["llm_fallbacks_per_request"] = results["app_counters"]["llm_fallbacks_total"] / completed
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {"python": platform.python_version(), "platform": platform.platform()},
+        "config": {
+            "endpoint": args.endpoint, "requests": args.requests, "concurrency": args.concurrency,
+            "warmup": args.warmup, "seed": args.seed, "cache": args.cache, "env": args.env,
+            "pregenerate": args.pregenerate,
+            "latency_median": args.latency_median, "latency_sigma": args.latency_sigma,
+            "error_rate": args.error_rate, "throttle_rate": args.throttle_rate, "retry_after": args.retry_after,
+            "rpm_limit": args.rpm_limit, "throttle_deployments": args.throttle_deployments,
+        },
+        "results": results,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100, help="压测请求数")
+    parser.add_argument("--concurrency", type=int, default=10, help="同时进行的请求数")
+    parser.add_argument("--warmup", type=int, default=5, help="正式压测前的预热请求数")
+    parser.add_argument("--endpoint", default="/api/llm-advice")
+    parser.add_argument("--timeout", type=float, default=300, help="单个请求的客户端超时（秒）")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--cache", action="store_true", help="开启LLM补全缓存（默认关闭，测量未命中路径）")
+    parser.add_argument("--pregenerate", action="store_true", help="压测前用同一批请求预生成建议库")
+    parser.add_argument("--answers", default=FIXTURE_ANSWERS, help="答案目录 fixture（JSON/CSV）")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="额外传给应用的环境变量")
+    parser.add_argument("--latency-median", type=float, default=0.5, help="替身LLM响应延迟中位数（秒）")
+    parser.add_argument("--latency-sigma", type=float, default=0.4, help="替身LLM延迟的对数正态 sigma")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="替身LLM返回 500 的比例")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="替身LLM返回 429 的比例")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="429 响应的 Retry-After（秒）")
+    parser.add_argument("--rpm-limit", type=int, default=0, help="替身LLM每个 deployment 的每分钟请求额度，超出返回 429")
+    parser.add_argument("--throttle-deployments", default="", help="逗号分隔，只对这些 deployment 注入 429")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="结果 JSON 输出路径")
+    parser.add_argument("--baseline", help="基线结果 JSON，用于检测退化")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="相对基线允许的退化比例")
+    parser.add_argument("--verbose", action="store_true", help="显示替身服务和应用的输出")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        report["regressions"] = compare(report["results"], baseline["results"], args.tolerance)
+
+    directory = os.path.dirname(os.path.abspath(args.output))
+    os.makedirs(directory, exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    results = report["results"]
+    latency = results["latency_ms"]
+    print(f"requests={results['requests']} errors={results['errors']} rps={results['requests_per_second']:.2f}")
+    print(f"latency_ms p50={latency['p50']:.1f} p95={latency['p95']:.1f} p99={latency['p99']:.1f}")
+    print(f"llm_calls_per_request={results['llm_calls_per_request']:.2f} "
+          f"llm_fallbacks_per_request={results['llm_fallbacks_per_request']:.3f} "
+          f"loop_lag_ms p99={results['loop_lag_ms']['p99_ms']:.1f} max={results['loop_lag_ms']['max_ms']:.1f}")
+    print(f"结果已写入 {args.output}")
+    if report.get("regressions"):
+        print("相对基线出现退化：")
+        for line in report["regressions"]:
+            print(f"  - {line}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+"""
+以压测模式启动 main:app：额外采样事件循环延迟，并通过 GET /__bench/loop-lag 暴露。
+
+    python -m benchmarks.serve_app --port 9000
+"""
+import time
+import asyncio
+import argparse
+from contextlib import asynccontextmanager
+
+LAG_INTERVAL = 0.01  # 采样间隔（秒）
+
+lag_samples = []
+
+
+async def _sample_loop_lag():
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(LAG_INTERVAL)
+        lag_samples.append(max(0.0, time.perf_counter() - start - LAG_INTERVAL))
+
+
+def instrument(app):
+    """在应用原有 lifespan 外层启动事件循环延迟采样，并注册读取接口。"""
+    original_lifespan = app.router.lifespan_context
+
+    @asynccontextmanager
+    async def lifespan(a):
+        async with original_lifespan(a):
+            task = asyncio.create_task(_sample_loop_lag())
+            try:
+                yield
+            finally:
+                task.cancel()
+
+    app.router.lifespan_context = lifespan
+
+    @app.get("/__bench/loop-lag")
+    async def loop_lag(reset: bool = False):
+        samples = sorted(lag_samples)
+        if reset:
+            lag_samples.clear()
+        if not samples:
+            return {"samples": 0, "p50_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+        return {
+            "samples": len(samples),
+            "p50_ms": samples[len(samples) // 2] * 1000,
+            "p99_ms": samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000,
+            "max_ms": samples[-1] * 1000,
+        }
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    args = parser.parse_args()
+
+    import uvicorn
+    from main import app
+    uvicorn.run(instrument(app), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,43 @@
-import os
-import csv
-import openai
-from fastapi import FastAPI, Request, HTTPException
+import asyncio
+from typing import Optional
+from fastapi import FastAPI, Request, HTTPException, Header
+from fastapi.responses import StreamingResponse, Response
 from api.models import AssessmentData , SaveReportResponse , LLMAdviceRequest , LLMAdviceResponse
+from api.models import JobSubmitResponse, JobStatusResponse, JobAdviceResult, AdviceEvent, AdviceSummary
+from api.models import advice_event_adapter, advice_summary_adapter
 from dotenv import load_dotenv
-from api.prompts import SYSTEM_PROMPT_TEMPLATE, USER_PROMPT_TEMPLATE
-from api.cosmos_retriever import get_answer_text
-from collections import defaultdict
+from api.observability import ServerTimingMiddleware, configure_logging, log_event, metrics_payload
+from api.answer_catalog import catalog
+from api.report_store import report_writer, ReportQueueFull
+from api.jobs import job_manager, JobQueueFull
+from api.advice_pipeline import (generate_advice, prepare_assessment, iter_advice, assemble_advice_text,
+                                 phase_outline, load_known_advice, save_assessment_state)
+from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
 from datetime import datetime
 from pydantic import BaseModel
 
 load_dotenv()
+# 结构化 JSON 日志（LOG_FORMAT=text 可切换为普通文本）
+configure_logging()
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 启动时一次性加载答案目录，并在后台按 TTL 刷新
+    await asyncio.to_thread(catalog.start)
+    if report_writer is not None:
+        report_writer.start()
+    job_manager.start()
+    yield
+    await job_manager.stop()
+    # 关闭前写完队列中剩余的报告
+    if report_writer is not None:
+        await report_writer.stop()
+    await asyncio.to_thread(catalog.stop)
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -22,56 +46,34 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# 统计请求耗时，并在响应头 Server-Timing 中返回各阶段耗时
+app.add_middleware(ServerTimingMiddleware)
 
-client = openai.AzureOpenAI(
-    api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-    api_version="2024-02-15-preview"
-)
 
-# 读取 score_rule.csv，返回 {question_id: [规则1, 规则2, ...]}
-def load_score_rules(csv_path):
-    rules = {}
-    with open(csv_path, newline='') as csvfile:
-        reader = csv.reader(csvfile)
-        headers = next(reader)
-        for row in reader:
-            qid = row[0]
-            rules[qid] = row[1:]
-    return rules
-
-# 判断是否满足加权规则
-def check_weighting(rules, service_offering):
-    satisfied_count = 0
-    
-    for rule in rules:
-        if not rule or '-' not in rule:
-            continue
-            
-        r_name, r_opts = rule.split('-')
-        r_name = r_name.strip()
-        r_opts = [opt.strip().lower() for opt in r_opts.strip().replace(' ', '').split('or')]
-        
-        found = False
-        for so in service_offering.values():
-            if so.get('question_name') == r_name:
-                user_ans = so.get('anwserselete', '').lower()
-                if user_ans in r_opts:
-                    satisfied_count += 1
-                break
-                
-    return satisfied_count
+# Prometheus 指标
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    payload, content_type = metrics_payload()
+    return Response(content=payload, media_type=content_type)
+
 
 # 1. 保存用户报告
 @app.post("/api/save-user-report", response_model=SaveReportResponse)
-async def save_user_report(data: AssessmentData):
-    print("收到数据", data.dict())
-    # 这里可以保存到数据库或文件
-    return {
-        "status": "success",
-        "message": "Report saved successfully",
-        "timestamp": datetime.utcnow().isoformat()
-    }
+async def save_user_report(data: AssessmentData, idempotency_key: Optional[str] = Header(None)):
+    if report_writer is None:
+        raise HTTPException(status_code=503, detail="Report store is not available")
+    # 只入队，由后台任务批量写入数据库；携带相同 Idempotency-Key 的重试不会重复保存
+    try:
+        # 只保存前端实际提交的字段，不写入模型默认值
+        report_id = await report_writer.enqueue(data.model_dump(mode="json", exclude_unset=True), idempotency_key)
+    except ReportQueueFull:
+        raise HTTPException(status_code=503, detail="Report queue is full, please retry later")
+    return SaveReportResponse(
+        status="success",
+        message="Report saved successfully",
+        timestamp=datetime.utcnow().isoformat(),
+        reportId=report_id
+    )
 
 
 
@@ -80,121 +82,88 @@ async def save_user_report(data: AssessmentData):
 
 @app.post("/api/llm-advice", response_model=LLMAdviceResponse)
 async def get_llm_advice(request: LLMAdviceRequest):
-    print("收到评估数据：", request.dict()) 
-    frontend_data = request.dict()
-    assessment_data = frontend_data['assessmentData']
-    service_offering = assessment_data['serviceOffering']
-    score_rules = load_score_rules('api/score_rule.csv')
-    all_questions = []
-    
-    # Extract business profile fields from service offering
-    industry = service_offering.get('industry', {}).get('text', '')
-    business_challenge = service_offering.get('business_challenge', {}).get('text', '')
-    service_type = service_offering.get('service_type', {}).get('text', '')
-    revenue_type = service_offering.get('revenue_type', {}).get('text', '')
-    
-    # 1. 收集所有问题，按顺序编号
-    for section_key, section in assessment_data.items():
-        if section_key == "serviceOffering":
-            continue
-        for q in section.values():
-            all_questions.append(q)
-    for idx, q in enumerate(all_questions):
-        q['question_id'] = f"question_{idx:02d}"
-    # 2. 处理加权和新分类
-    for q in all_questions:
-        qid = q['question_id']
-        rules = score_rules.get(qid, [])
-        original_score = q.get('score', 0)
-        
-        # 获取满足的规则数量
-        satisfied_count = check_weighting(rules, service_offering)
-        
-        # 根据满足的规则数量计算加权倍数
-        if satisfied_count > 0:
-            weight_multiplier = 1 + (satisfied_count * 0.25)  # 每个规则加权25%
-            new_score = original_score * weight_multiplier
-        else:
-            new_score = original_score
-        
-        q['new_score'] = new_score
-        # 新分类
-        if new_score < -1:
-            q['new_category'] = 'Start_Doing'
-        elif new_score > 1:
-            q['new_category'] = 'Keep_Doing'
-        else:
-            q['new_category'] = 'Do_More'
-    # 3. 检索数据库并增强
-    results = []
-    for q in all_questions:
-        question_id = q['question_id']
-        new_category = q['new_category']
-        base_text = get_answer_text(question_id, new_category)
-        if base_text is None:
-            base_text = "未找到数据库答案。"
-        # 构建prompt with new business profile fields
-        prompt = USER_PROMPT_TEMPLATE.format(
-            retrieved_text=base_text,
-            original_question=q.get('question', ''),
-            advice_type=new_category
-        )
-        # 调用LLM处理这一批问题
-        try:
-            response = client.chat.completions.create(
-                model=os.getenv("AZURE_OPENAI_DEPLOYMENT"),
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT_TEMPLATE.format(
-                        industry=industry,
-                        business_challenge=business_challenge,
-                        service_type=service_type,
-                        revenue_type=revenue_type
-                    )},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7,
-                max_tokens=1024  # 增加token数量以处理更多内容
-            )
-            llm_response = response.choices[0].message.content
-        except Exception as e:
-            llm_response = f"LLM生成失败: {e}"
-        results.append({
-            "catmapping": q.get("catmapping", ""),
-            "category": q.get("category", ""),
-            "question": q.get("question", ""),
-            "advice": llm_response
-        })
-
-    # 4. 分阶段、分category分组
-    phase_map = {
-        "Profitable": "Phase 1 (Profitable)",
-        "Repeatable": "Phase 2 (Repeatable)",
-        "Scalable": "Phase 3 (Scalable)"
-    }
-    phase_order = ["Profitable", "Repeatable", "Scalable"]
-
-    # phase -> category -> [advice]
-    phase_grouped = {phase: defaultdict(list) for phase in phase_order}
-    for item in results:
-        phase = item["catmapping"]
-        category = item["category"]
-        if phase in phase_grouped:
-            phase_grouped[phase][category].append(item)
-
-    # 5. 拼接建议文本
-    advice_text = "Based on your assessment results, here are your business recommendations:\n\n"
-    for phase in phase_order:
-        phase_title = phase_map[phase]
-        advice_text += f"=== {phase_title} ===\n"
-        for category, items in phase_grouped[phase].items():
-            advice_text += f"\n【{category}】\n"
-            for item in items:
-                advice_text += f"- {item['question']}\n  {item['advice']}\n"
-        advice_text += "\n"
-
-    print("LLM生成的建议:\n", advice_text)
-    return {
-        "advice": advice_text,
-        "timestamp": datetime.utcnow().isoformat(),
-        "confidence_score": 0.85
-    }
\ No newline at end of file
+    assessment_data = request.assessmentData
+    log_event("llm_advice_request", userId=request.userId, sections=len(assessment_data.model_extra or {}))
+    # 同一 userId 重新提交时只重新生成发生变化的问题
+    generated = await generate_advice(assessment_data, request.userId)
+    regenerated = len(generated.results) - generated.reused
+
+    log_event("llm_advice_generated", userId=request.userId, questions=len(generated.results),
+              reused=generated.reused, advice_chars=len(generated.advice_text))
+    return LLMAdviceResponse(
+        advice=generated.advice_text,
+        timestamp=datetime.utcnow().isoformat(),
+        reusedCount=generated.reused,
+        regeneratedCount=regenerated
+    )
+
+
+# 3. 流式获取LLM建议：每个问题生成完成后立即推送一条事件，最后推送汇总事件
+@app.post("/api/llm-advice/stream")
+async def stream_llm_advice(request: LLMAdviceRequest, format: str = "sse"):
+    if format not in ("sse", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be 'sse' or 'ndjson'")
+    prepared = await prepare_assessment(request.assessmentData)
+    known = await load_known_advice(request.userId, prepared)
+
+    def encode(event: str, payload: bytes) -> bytes:
+        if format == "ndjson":
+            return b'{"event":"' + event.encode() + b'","data":' + payload + b'}\n'
+        return b"event: " + event.encode() + b"\ndata: " + payload + b"\n\n"
+
+    async def event_stream():
+        results = [None] * len(prepared.questions)
+        async for idx, item in iter_advice(prepared, known=known):
+            results[idx] = item
+            yield encode("advice", advice_event_adapter.dump_json(AdviceEvent(
+                index=idx,
+                question_id=prepared.questions[idx].question_id,
+                phase=item.catmapping,
+                category=item.category,
+                question=item.question,
+                advice=item.advice
+            )))
+        # 客户端中途断开时不会执行到这里，不保存不完整的状态
+        await save_assessment_state(request.userId, prepared, results)
+        yield encode("summary", advice_summary_adapter.dump_json(AdviceSummary(
+            phases=phase_outline(results),
+            advice=assemble_advice_text(results),
+            timestamp=datetime.utcnow().isoformat(),
+            reusedCount=len(known),
+            regeneratedCount=len(results) - len(known)
+        )))
+
+    media_type = "application/x-ndjson" if format == "ndjson" else "text/event-stream"
+    return StreamingResponse(event_stream(), media_type=media_type,
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+
+# 4. 异步任务模式：提交后立即返回任务ID，后台 worker 生成建议，通过 GET 查询进度和结果
+@app.post("/api/llm-advice/jobs", response_model=JobSubmitResponse, status_code=202)
+async def submit_llm_advice_job(request: LLMAdviceRequest):
+    try:
+        job, created = await job_manager.submit(request.userId, request.assessmentData)
+    except JobQueueFull:
+        raise HTTPException(status_code=503, detail="Job queue is full, please retry later")
+    return JobSubmitResponse(jobId=job.id, status=job.status, deduplicated=not created)
+
+
+@app.get("/api/llm-advice/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_llm_advice_job(job_id: str):
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JobStatusResponse(
+        jobId=job.id,
+        status=job.status,
+        total=job.total,
+        completed=len(job.results),
+        results=[JobAdviceResult(index=idx, **job.results[idx]) for idx in sorted(job.results)],
+        advice=job.advice,
+        error=job.error,
+        reusedCount=job.reused,
+        regeneratedCount=job.total - job.reused,
+        createdAt=datetime.utcfromtimestamp(job.created_at).isoformat(),
+        updatedAt=datetime.utcfromtimestamp(job.updated_at).isoformat()
+    )
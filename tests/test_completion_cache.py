@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+from api.completion_cache import CompletionCache
+
+
+def test_waiter_gets_value_when_owner_is_cancelled():
+    async def main():
+        cache = CompletionCache()
+        calls = 0
+
+        async def factory():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            return "advice"
+
+        owner = asyncio.ensure_future(cache.get_or_create("k", factory))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(cache.get_or_create("k", factory))
+        await asyncio.sleep(0)
+        owner.cancel()
+        assert await waiter == "advice"
+        assert owner.cancelled()
+        assert calls == 1
+        assert cache.stats["coalesced"] == 1
+
+    asyncio.run(main())
+
+
+def test_call_is_cancelled_when_all_waiters_are_cancelled():
+    async def main():
+        cache = CompletionCache()
+        started = asyncio.Event()
+        cancelled = asyncio.Event()
+
+        async def factory():
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+            return "advice"
+
+        callers = [asyncio.ensure_future(cache.get_or_create("k", factory)) for _ in range(2)]
+        await started.wait()
+        for caller in callers:
+            caller.cancel()
+        await asyncio.wait_for(cancelled.wait(), timeout=1)
+        assert cache._inflight == {}
+
+        # 之后的相同请求重新发起调用
+        async def second():
+            return "again"
+
+        assert await cache.get_or_create("k", second) == "again"
+
+    asyncio.run(main())
+
+
+def test_failed_call_is_not_cached():
+    async def main():
+        cache = CompletionCache()
+
+        async def failing():
+            raise ValueError("boom")
+
+        async def succeeding():
+            return "advice"
+
+        with pytest.raises(ValueError):
+            await cache.get_or_create("k", failing)
+        assert await cache.get_or_create("k", succeeding) == "advice"
+        assert cache.stats["misses"] == 2
+        assert await cache.get_or_create("k", failing) == "advice"
+        assert cache.stats["memory_hits"] == 1
+
+    asyncio.run(main())
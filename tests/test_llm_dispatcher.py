@@ -0,0 +1,38 @@
+import pytest
+
+from api.llm_dispatcher import RateBudget
+
+
+def full_budget(per_minute, now=0.0):
+    budget = RateBudget(per_minute)
+    budget._level, budget._updated = budget.capacity, now
+    return budget
+
+
+def test_large_call_is_charged_in_full():
+    budget = full_budget(30000)  # 每秒 500 token，桶容量 500
+    assert budget.wait_time(1300, 0.0) == 0.0
+    budget.consume(1300, 0.0)
+    # 欠 800 token，下一次调用要先补回欠额再攒够自己的用量
+    assert budget.wait_time(1300, 0.0) == pytest.approx((800 + 500) / 500)
+    assert budget.wait_time(1300, 1.6) == pytest.approx(1.0)
+    assert budget.wait_time(1300, 2.6) == 0.0
+
+
+def test_sustained_rate_stays_within_budget():
+    budget = full_budget(30000)
+    now, sent = 0.0, 0
+    while True:
+        now += budget.wait_time(1300, now)
+        if now >= 60:
+            break
+        budget.consume(1300, now)
+        sent += 1300
+    # 最多比每分钟额度多出一次突发（1 秒的额度）加一次调用
+    assert sent <= 30000 + budget.capacity + 1300
+
+
+def test_unlimited_budget_never_waits():
+    budget = RateBudget(0)
+    budget.consume(10 ** 6, 0.0)
+    assert budget.wait_time(10 ** 6, 0.0) == 0.0